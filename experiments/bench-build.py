@@ -0,0 +1,46 @@
+"""Benchmark for building permission trees from clauses with many
+actions and many objects.
+
+Times ``PermissionTree.from_policies`` for a policy with one clause
+covering every combination of a list of actions and a list of
+objects, followed by a clause overriding a few of them, and reports
+the number of compiled tree states and the pickled size of the
+compiled tree.  Clauses are inserted as products, with all the actions
+sharing one object subtree, so these should hardly grow with the
+number of actions.
+
+Run from the repository root:
+
+  $ python experiments/bench-build.py
+
+"""
+import json
+import os
+import pickle
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tutelary.engine import PermissionTree, PolicyBody  # noqa
+
+
+NOBJECTS = 5000
+
+print('{:>8s} {:>10s} {:>8s} {:>12s}'.format(
+    'actions', 'build', 'states', 'pickled'))
+for nactions in (1, 5, 20):
+    policy = PolicyBody(json=json.dumps({'clause': [
+        {'effect': 'allow',
+         'action': ['parcel.action' + str(i) for i in range(nactions)],
+         'object': ['Cadasta/Test/parcel/' + str(i)
+                    for i in range(NOBJECTS)]},
+        {'effect': 'deny', 'action': ['parcel.action0'],
+         'object': ['Cadasta/Test/parcel/' + str(i) for i in range(10)]}
+    ]}))
+    t = time.perf_counter()
+    ptree = PermissionTree.from_policies([policy]).compile()
+    t = time.perf_counter() - t
+    print('{:8d} {:7.1f} ms {:8d} {:6d} bytes'.format(
+        nactions, t * 1e3, len(ptree.compiled.items),
+        len(pickle.dumps(ptree))))
@@ -0,0 +1,72 @@
+"""Micro-benchmark for permission tree lookups.
+
+Builds a permission tree resembling a project with many explicitly
+permissioned parcels and times ``PermissionTree.allow`` for exact
+matches, wildcard matches that need backtracking, and misses, for
+both plain and compiled permission trees, and compares batched
+``allow_many`` tests with one ``allow`` call per object.  Also
+compares pickled size and load time for the two forms.
+
+Run from the repository root:
+
+  $ python experiments/bench-lookup.py
+
+"""
+import json
+import os
+import pickle
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tutelary.engine import Action, Object, PermissionTree, PolicyBody  # noqa
+
+
+NOBJECTS = 2000
+NUMBER = 20000
+
+policy = PolicyBody(json=json.dumps({'clause': [
+    {'effect': 'allow', 'action': ['parcel.*'],
+     'object': ['Cadasta/*/parcel/*']},
+    {'effect': 'deny', 'action': ['parcel.edit'],
+     'object': ['Cadasta/Test/parcel/' + str(i) for i in range(NOBJECTS)]},
+    {'effect': 'allow', 'action': ['parcel.view'],
+     'object': ['Cadasta/Test/parcel/*']},
+    {'effect': 'deny', 'action': ['parcel.view'],
+     'object': ['Cadasta/Test/parcel/' + str(i)
+                for i in range(0, NOBJECTS, 2)]}
+]}))
+ptree = PermissionTree(policies=[policy])
+
+cases = [
+    ('exact match', Action('parcel.edit'), Object('Cadasta/Test/parcel/17')),
+    ('wildcard match', Action('parcel.view'),
+     Object('Cadasta/Test/parcel/17')),
+    ('backtracking', Action('parcel.delete'),
+     Object('Cadasta/Test/parcel/17')),
+    ('miss', Action('party.edit'), Object('Cadasta/Test/party/17'))
+]
+
+compiled = PermissionTree(policies=[policy]).compile()
+
+print('{:16s} {:>14s} {:>14s}'.format('', 'tree', 'compiled'))
+for name, act, obj in cases:
+    ts = [timeit.timeit(lambda: pt.allow(act, obj), number=NUMBER)
+          for pt in (ptree, compiled)]
+    print('{:16s} {:8.2f} us/op {:8.2f} us/op'.format(
+        name, *[t / NUMBER * 1e6 for t in ts]))
+
+pairs = [(Action('parcel.view'), Object('Cadasta/Test/parcel/' + str(i)))
+         for i in range(NOBJECTS)]
+ts = [timeit.timeit(f, number=10) / 10 for f in
+      (lambda: [compiled.allow(a, o) for a, o in pairs],
+       lambda: compiled.allow_many(pairs))]
+print('{:d} objects: allow {:6.2f} ms, allow_many {:6.2f} ms'.format(
+    NOBJECTS, *[t * 1e3 for t in ts]))
+
+for name, pt in (('tree', ptree), ('compiled', compiled)):
+    data = pickle.dumps(pt)
+    t = timeit.timeit(lambda: pickle.loads(data), number=100) / 100
+    print('pickled {:9s} {:8d} bytes, load {:6.2f} ms'.format(
+        name, len(data), t * 1e3))
@@ -0,0 +1,46 @@
+"""Micro-benchmark for action and object construction.
+
+Times ``Object`` parsing for paths with and without backslash escapes
+(only escaped paths need the escape-aware regexp), construction from
+lists of components and from pre-split component tuples, and interned
+construction with ``Object.get``.
+
+Run from the repository root:
+
+  $ python experiments/bench-parse.py
+
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tutelary.engine import Object, make_regex, unescape  # noqa
+
+
+NUMBER = 100000
+
+plain = 'Cadasta/Batangas/parcel/123'
+escaped = 'Cadasta/Bat\\/angas/parcel/123'
+components = ['Cadasta', 'Batangas', 'parcel', '123']
+regex = make_regex('/')
+
+
+def regex_split(s):
+    # The parsing used for all paths before the str.split fast path.
+    return [unescape(c, '/') for c in regex.split(s)[1::2]]
+
+
+cases = [
+    ('regex split', lambda: regex_split(plain)),
+    ('Object(plain)', lambda: Object(plain)),
+    ('Object(escaped)', lambda: Object(escaped)),
+    ('Object(list)', lambda: Object(components)),
+    ('from_components', lambda: Object.from_components(tuple(components))),
+    ('Object.get', lambda: Object.get(plain))
+]
+
+for name, f in cases:
+    t = timeit.timeit(f, number=NUMBER)
+    print('{:16s} {:8.2f} us/op'.format(name, t / NUMBER * 1e6))
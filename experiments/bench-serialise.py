@@ -0,0 +1,58 @@
+"""Benchmark for permission tree serialisation.
+
+Compares the size and load time of a compiled permission tree in the
+compact binary encoding (``to_bytes``, also used when pickling) with
+the previous pickle of the compiled tree's nested tuples and
+dictionaries, and with the JSON representation of the uncompiled
+tree.  Load times are given both for loading alone and for loading
+followed by a single ``allow`` test, since the binary encoding only
+decodes the parts of the tree that are used.
+
+Run from the repository root:
+
+  $ python experiments/bench-serialise.py
+
+"""
+import json
+import os
+import pickle
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tutelary.engine import Action, Object, PermissionTree, PolicyBody  # noqa
+
+
+NUMBER = 20
+
+act, obj = Action('parcel.view'), Object('Cadasta/Test/parcel/17')
+
+print('{:>8s} {:10s} {:>10s} {:>10s} {:>10s}'.format(
+    'objects', 'format', 'bytes', 'load', 'load+test'))
+for nobjects in (100, 2000, 20000):
+    policy = PolicyBody(json=json.dumps({'clause': [
+        {'effect': 'allow', 'action': ['parcel.*'],
+         'object': ['Cadasta/*/parcel/*']},
+        {'effect': 'deny', 'action': ['parcel.edit', 'parcel.view'],
+         'object': ['Cadasta/Test/parcel/' + str(i)
+                    for i in range(nobjects)]}
+    ]}))
+    ptree = PermissionTree.from_policies([policy]).compile()
+    c = ptree.compiled
+    formats = [
+        ('old pickle',
+         pickle.dumps((c.items, c.final, c.trans, c.fallback), protocol=-1),
+         pickle.loads, lambda t: t[2][0].get('view')),
+        ('pickle', pickle.dumps(ptree, protocol=-1),
+         pickle.loads, lambda t: t.allow(act, obj)),
+        ('to_bytes', ptree.to_bytes(),
+         PermissionTree.from_bytes, lambda t: t.allow(act, obj)),
+        ('to_json', ptree.tree.to_json(),
+         lambda d: PermissionTree(json=d), lambda t: t.allow(act, obj))
+    ]
+    for name, data, load, test in formats:
+        ts = [timeit.timeit(f, number=NUMBER) / NUMBER
+              for f in (lambda: load(data), lambda: test(load(data)))]
+        print('{:8d} {:10s} {:10d} {:7.2f} ms {:7.2f} ms'.format(
+            nobjects, name, len(data), *[t * 1e3 for t in ts]))
@@ -74,6 +74,27 @@ class CheckModel5(models.Model):
         actions = ['check5.detail', 'check5.delete']
 
 
+@permissioned_model
+class CheckModel6(models.Model):
+    name = models.CharField(max_length=100)
+
+    class TutelaryMeta:
+        perm_type = 'check6'
+        path_fields = ('pk',)
+        actions = ['check6.detail']
+
+
+@permissioned_model
+class CheckModel7(models.Model):
+    container = models.ForeignKey(CheckModel6)
+
+    class TutelaryMeta:
+        perm_type = 'check7'
+        path_fields = ('container', 'pk')
+        actions = [('check7.list', {'permissions_object': 'container'}),
+                   'check7.detail']
+
+
 class CheckModel1Broken(models.Model):
     name = models.CharField(max_length=100)
 
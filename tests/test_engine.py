@@ -1,18 +1,18 @@
 import pytest
 
-from tutelary.engine import Action, Object, SimpleSeparated
+from tutelary.engine import Action, Object, SimpleSeparated, make_regex
 
 
 def test_sequence_creation_empty():
     seq1 = SimpleSeparated(None)
     assert len(seq1) == 0
-    assert seq1.components == []
+    assert seq1.components == ()
 
 
 def test_sequence_creation_components():
     seq2 = SimpleSeparated(['parcel', 'list'])
     assert len(seq2) == 2
-    assert seq2.components == ['parcel', 'list']
+    assert seq2.components == ('parcel', 'list')
 
 
 def test_sequence_creation_bad():
@@ -71,3 +71,41 @@ def test_object_wildcards():
     for o1, ms in zip(objs, matches):
         for o2, m in zip(objs, ms):
             assert o1.match(o2) == m
+
+
+def test_sequence_hash_and_equality():
+    assert Action('parcel.edit') == Action(['parcel', 'edit'])
+    assert hash(Action('parcel.edit')) == hash(Action(['parcel', 'edit']))
+    assert len({Object('Cadasta/X\/Y/parcel/1'),
+                Object(['Cadasta', 'X/Y', 'parcel', '1'])}) == 1
+    with pytest.raises(AttributeError):
+        Action('parcel.edit').extra = 1
+
+
+def test_sequence_interning():
+    act = Action.get('parcel.edit')
+    assert act is Action.get('parcel.edit')
+    assert act == Action('parcel.edit')
+    obj = Object.get('Cadasta/Batangas/parcel/123')
+    assert obj is Object.get('Cadasta/Batangas/parcel/123')
+    assert isinstance(obj, Object)
+    assert Action.get('parcel.edit') is not Object.get('parcel.edit')
+
+
+def test_object_parsing_fast_path():
+    # Paths without backslashes are split without the regexp, but
+    # must give the same components.
+    regex = make_regex('/')
+    for s in ['Cadasta/Batangas/parcel/123', '/Cadasta//parcel/', '', '/']:
+        assert list(Object(s).components) == regex.split(s)[1::2]
+    assert Object('/Cadasta//parcel/').components == ('Cadasta', 'parcel')
+    assert Object('').components == ()
+    assert Object('a\\\\/b').components == ('a\\', 'b')
+
+
+def test_object_from_components():
+    obj = Object.from_components(('Cadasta', 'X/Y', 'parcel', '123'))
+    assert obj == Object('Cadasta/X\/Y/parcel/123')
+    assert hash(obj) == hash(Object('Cadasta/X\/Y/parcel/123'))
+    assert isinstance(obj, Object)
+    assert str(obj) == 'Cadasta/X\/Y/parcel/123'
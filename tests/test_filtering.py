@@ -1,7 +1,14 @@
+from django.contrib.auth.models import AnonymousUser, User
 from django.core.exceptions import PermissionDenied
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 import django.views.generic as generic
+import rest_framework.generics as generics
+from rest_framework.test import APIRequestFactory, force_authenticate
 
-from tutelary.mixins import PermissionRequiredMixin
+from tutelary.decorators import get_perms_related, select_perms_related
+from tutelary.mixins import APIPermissionRequiredMixin, PermissionRequiredMixin
+from tutelary.models import check_perms_many, perms_filter_pks, perms_q
 
 import pytest
 from django.test import RequestFactory
@@ -217,3 +224,181 @@ def test_detail_with_private_filter_listing(datadir, setup):  # noqa
     assert project_count(view(r3).render()) == 2
     assert project_count(view(r4).render()) == 0
     assert project_count(view(r5).render()) == 6
+
+
+class DBProjList(BaseProjList):
+    def get_queryset(self):
+        return Proj.objects.all()
+
+
+@pytest.fixture(scope="function")  # noqa
+def db_setup(setup):
+    # The test models don't have tables in the test database, so they
+    # are created here (and dropped when the test transaction is
+    # rolled back).
+    users, pols, orgs, projs = setup
+    with connection.schema_editor() as editor:
+        editor.create_model(Org)
+        editor.create_model(Proj)
+    for obj in orgs + projs:
+        obj.save()
+    return setup
+
+
+@pytest.mark.parametrize('filter_queryset,counts', [
+    (True, [10, 7, 3, 0, 10]),
+    (['proj.detail'], [10, 3, 3, 0, 8]),
+    (['proj.delete'], [10, 1, 2, 0, 0]),
+    (['proj.detail', 'proj.delete'], [10, 1, 2, 0, 0])
+])
+def test_database_filter_listing(datadir, db_setup,  # noqa
+                                 filter_queryset, counts):
+    users, pols, orgs, projs = db_setup
+    view_class = type('View', (PermissionRequiredMixin, DBProjList), {
+        'permission_required': 'proj.list',
+        'permission_filter_queryset': filter_queryset
+    })
+    for user, count in zip(users, counts):
+        view = view_class.as_view()
+        with CaptureQueriesContext(connection) as queries:
+            response = view(api_get('/projs', user)).render()
+        assert project_count(response) == count
+        # The filtering is done in the database: the only query is the
+        # one for the filtered objects (if any could be permitted).
+        assert len([q for q in queries
+                    if 'tests_proj' in q['sql']]) == (1 if count else 0)
+
+
+def test_database_filter_listing_callable(datadir, db_setup):  # noqa
+    users, pols, orgs, projs = db_setup
+    r1, r2, r3, r4, r5 = map(lambda u: api_get('/projs', u), users)
+
+    class View(PermissionRequiredMixin, DBProjList):
+        permission_required = 'proj.list'
+        permission_filter_queryset = (
+            lambda self, view, proj:
+            ('proj.detail',) if proj.public else ('proj.detail_private',)
+        )
+    view = View.as_view()
+    assert project_count(view(r1).render()) == 8
+    assert project_count(view(r2).render()) == 3
+    assert project_count(view(r5).render()) == 6
+
+
+@pytest.mark.parametrize('filter_queryset', [
+    True, ['proj.detail'], lambda self, view, proj: ('proj.detail',)
+])
+def test_database_filter_listing_false(datadir, db_setup,  # noqa
+                                       filter_queryset):
+    users, pols, orgs, projs = db_setup
+    view_class = type('View', (PermissionRequiredMixin, DBProjList), {
+        'permission_required': lambda self, view, request: False,
+        'permission_filter_queryset': filter_queryset
+    })
+    response = view_class.as_view()(api_get('/projs', users[0])).render()
+    assert project_count(response) == 0
+
+    # Actions given as False are never permitted.
+    assert not Proj.objects.filter(perms_q(users[0], False, Proj)).exists()
+    assert list(perms_filter_pks(users[0], False, Proj.objects.all())) == []
+    assert check_perms_many(users[0], False, projs) == [False] * len(projs)
+    assert check_perms_many(users[0], lambda p: False, projs[:1]) == [False]
+
+
+def test_perms_q(datadir, db_setup):  # noqa
+    users, pols, orgs, projs = db_setup
+    users[3].is_superuser = True
+    action_sets = [(), ('proj.list',), ('proj.detail',), ('proj.delete',),
+                   ('proj.list', 'proj.detail'), ('proj.detail_private',)]
+    for user in users + [AnonymousUser()]:
+        for actions in action_sets:
+            q = perms_q(user, actions, Proj)
+            expected = [p for p, ok in
+                        zip(projs, check_perms_many(user, actions, projs))
+                        if ok]
+            assert (sorted(p.pk for p in Proj.objects.filter(q)) ==
+                    [p.pk for p in expected])
+    assert perms_q(users[0], ('proj.list',), User) is None
+
+
+def test_perms_filter_pks(datadir, db_setup):  # noqa
+    users, pols, orgs, projs = db_setup
+    action_sets = [(), ('proj.list',), ('proj.detail',),
+                   ('proj.list', 'proj.delete'),
+                   lambda p: (('proj.detail',) if p.public
+                              else ('proj.detail_private',))]
+    for user in users:
+        for actions in action_sets:
+            expected = [p.pk for p, ok in
+                        zip(projs, check_perms_many(user, actions, projs))
+                        if ok]
+            with CaptureQueriesContext(connection) as queries:
+                pks = list(perms_filter_pks(user, actions,
+                                            Proj.objects.order_by('pk'),
+                                            chunk_size=3))
+            assert pks == expected
+            # Only the path fields are read for permissions objects
+            # made from them.
+            sql = [q['sql'] for q in queries if 'tests_proj' in q['sql']]
+            assert len(sql) == 1
+            assert ('"tests_proj"."public"' in sql[0]) == callable(actions)
+
+
+def test_select_perms_related(datadir, db_setup):  # noqa
+    users, pols, orgs, projs = db_setup
+    assert Proj.TutelaryMeta.related_paths == ['org']
+    assert Org.TutelaryMeta.related_paths == []
+    assert get_perms_related(Proj, ('proj.detail',)) == ['org']
+    assert get_perms_related(Proj, ('proj.list',)) == ['org']
+    assert get_perms_related(Org) == []
+
+    def queries_for_check(objs):
+        with CaptureQueriesContext(connection) as queries:
+            check_perms_many(users[0], ('proj.detail',), objs)
+        return len([q for q in queries if 'tests_' in q['sql']])
+    assert queries_for_check(Proj.objects.all()) == 1 + len(projs)
+    assert queries_for_check(select_perms_related(Proj.objects.all())) == 1
+
+    # Deferred foreign keys can't be followed with select_related.
+    for objs, related in [(Proj.objects.only('name'), False),
+                          (Proj.objects.defer('org'), False),
+                          (Proj.objects.defer('name'), {'org': {}}),
+                          (Proj.objects.only('name', 'org'), {'org': {}})]:
+        objs = select_perms_related(objs)
+        assert objs.query.select_related == related
+        assert all(check_perms_many(users[0], ('proj.detail',), objs))
+
+    class OnlyView(PermissionRequiredMixin, DBProjList):
+        permission_required = 'proj.detail'
+
+        def get_queryset(self):
+            return Proj.objects.only('name')
+    assert OnlyView.as_view()(api_get('/projs', users[0])).status_code == 200
+
+
+def test_database_permission_required_false(datadir, db_setup):  # noqa
+    users, pols, orgs, projs = db_setup
+
+    class View(PermissionRequiredMixin, DBProjList):
+        permission_required = lambda self, view, request: False  # noqa
+    with pytest.raises(PermissionDenied):
+        View.as_view()(api_get('/projs', users[0]))
+
+    class APIView(APIPermissionRequiredMixin, generics.ListAPIView):
+        permission_required = lambda self, view, request: False  # noqa
+
+        def get_queryset(self):
+            return Proj.objects.all()
+    request = APIRequestFactory().get('/projs')
+    force_authenticate(request, user=users[0])
+    assert APIView.as_view()(request).status_code == 403
+
+    # Non-filtering views over querysets check every object with a
+    # fixed number of queries.
+    class View(PermissionRequiredMixin, DBProjList):
+        permission_required = 'proj.detail'
+    with CaptureQueriesContext(connection) as queries:
+        with pytest.raises(PermissionDenied):
+            View.as_view()(api_get('/projs', users[1]))
+    assert not any('tests_org' in q['sql'] and 'tests_proj' not in q['sql']
+                   for q in queries)
@@ -1,6 +1,8 @@
+import json
 from django.core.exceptions import PermissionDenied, ImproperlyConfigured
 from django.contrib.auth import get_backends
-from django.db import models
+from django.db import connection, models
+from django.test.utils import CaptureQueriesContext
 from django.http import HttpResponse
 import django.views.generic as generic
 import django.views.generic.edit as edit
@@ -8,9 +10,15 @@ import django.views.generic.edit as edit
 import pytest
 from django.test import RequestFactory
 
-from tutelary.engine import Action
-from tutelary.decorators import permissioned_model, permission_required
+from tutelary.engine import Action, interned
+from tutelary.decorators import (
+    get_perms_lookups, get_perms_object, get_perms_related,
+    permissioned_model, permission_required
+)
 from tutelary.mixins import PermissionRequiredMixin
+from tutelary.models import (
+    Policy, check_perms_many, perms_filter_pks, perms_q
+)
 from tutelary.exceptions import (
     PermissionObjectException, DecoratorException,
     InvalidPermissionObjectException
@@ -20,7 +28,7 @@ from .factories import UserFactory, PolicyFactory
 from .datadir import datadir  # noqa
 from .check_models import (
     CheckModel1, CheckModel2, CheckModel3, CheckModel4, CheckModel5,
-    CheckModel1Broken
+    CheckModel6, CheckModel7, CheckModel1Broken
 )
 
 
@@ -342,3 +350,111 @@ def test_backend_exceptions(datadir, setup):  # noqa
 
     with pytest.raises(InvalidPermissionObjectException):
         assert get_backends()[0].permitted_actions(user1, ok_obj) != []
+
+
+def test_backend_has_perms_many(datadir, setup):  # noqa
+    user1, user2 = setup
+    ok_obj = CheckModel1(name='not-secret')
+    secret_obj = CheckModel1(name='secret')
+    pairs = [('check.detail', ok_obj), ('check.detail', secret_obj),
+             ('check.list', None)]
+
+    backend = get_backends()[0]
+    for user in (user1, user2):
+        assert (backend.has_perms_many(user, pairs) ==
+                [user.has_perm(a, o) for a, o in pairs])
+    assert check_perms_many(user1, ['check.detail'],
+                            [ok_obj, secret_obj]) == [True, False]
+    assert check_perms_many(user2, ['check.detail'],
+                            [ok_obj, secret_obj]) == [True, True]
+    with pytest.raises(InvalidPermissionObjectException):
+        backend.has_perms_many(user1, [('check.detail',
+                                        CheckModel1Broken(name='broken'))])
+
+
+def test_backend_object_strings(datadir, setup):  # noqa
+    user1, user2 = setup
+    secret_path = str(CheckModel1(name='secret')
+                      .get_permissions_object('check.detail'))
+    assert not user1.has_perm('check.detail', secret_path)
+    assert user2.has_perm('check.detail', secret_path)
+    assert (get_backends()[0].has_perms_many(
+        user2, [('check.detail', secret_path)]) == [True])
+
+    # Object strings don't fill up the interned actions.
+    size = interned.cache_info().currsize
+    for i in range(10):
+        user1.has_perm('check.detail', 'check/{}'.format(i))
+    assert interned.cache_info().currsize == size
+
+
+def test_permissions_object_paths():
+    c1 = CheckModel1(name='a/b')
+    c2 = CheckModel2(pk=3, name='x', container=c1)
+    assert str(c1.get_permissions_object('check.detail')) == r'check/a\/b'
+    assert c1.get_permissions_object('check.list') is None
+    assert (c2.get_permissions_object('check2.detail') ==
+            get_perms_object(c2, 'check2.detail'))
+    assert str(c2.get_permissions_object('check2.detail')) == r'check2/a\/b/3'
+    assert str(c2.get_permissions_object('check2.list')) == r'check/a\/b'
+
+    # Related primary keys are read from foreign key columns, without
+    # loading the related object (there's no database access here).
+    c7 = CheckModel7(pk=2, container_id=1)
+    assert str(c7.get_permissions_object('check7.detail')) == 'check7/1/2'
+    c7 = CheckModel7(pk=2, container=CheckModel6(pk=1))
+    assert str(c7.get_permissions_object('check7.list')) == 'check6/1'
+
+
+def test_related_pk_path_fields():
+    # Path fields ending at a related primary key use the foreign key
+    # column, so no join or related object is needed for them.
+    assert CheckModel7.TutelaryMeta.pfs == ['check7', ['container_id'], ['pk']]
+    assert CheckModel7.TutelaryMeta.related_paths == []
+    assert get_perms_related(CheckModel7, ['check7.detail']) == []
+    assert get_perms_related(CheckModel7, ['check7.list']) == ['container']
+    pattern, lookups = get_perms_lookups(CheckModel7, 'check7.detail')
+    assert pattern == ('check7', None, None)
+    assert [(lookup, f.name) for lookup, f in lookups] == [
+        ('container_id', 'container'), ('pk', 'id')
+    ]
+    assert (str(get_perms_object(CheckModel7(pk=2, container_id=1), None)) ==
+            'check7/1/2')
+
+
+def test_related_pk_path_queries(db):
+    # The test models don't have tables in the test database.
+    with connection.schema_editor() as editor:
+        editor.create_model(CheckModel6)
+        editor.create_model(CheckModel7)
+    c6s = [CheckModel6.objects.create(name=str(i)) for i in range(2)]
+    c7s = [CheckModel7.objects.create(container=c) for c in c6s * 2]
+    pol = Policy.objects.create(name='check7', body=json.dumps({'clause': [
+        {'effect': 'allow', 'action': ['check7.detail'],
+         'object': ['check7/{}/*'.format(c6s[0].pk)]}
+    ]}))
+    user = UserFactory.create(username='user1')
+    user.assign_policies(pol)
+    expected = [c.pk for c in c7s if c.container_id == c6s[0].pk]
+
+    # Permissions objects of instances loaded without their related
+    # objects are computed without any query.
+    objs = list(CheckModel7.objects.only('container').order_by('pk'))
+    with CaptureQueriesContext(connection) as queries:
+        paths = [o.get_permissions_object('check7.detail') for o in objs]
+    assert len(queries) == 0
+    assert [str(p) for p in paths] == [
+        'check7/{}/{}'.format(c.container_id, c.pk) for c in c7s
+    ]
+
+    # Filtering reads the foreign key column, without joining the
+    # related table.
+    q = perms_q(user, ('check7.detail',), CheckModel7)
+    objs = CheckModel7.objects.filter(q).order_by('pk')
+    assert [o.pk for o in objs] == expected
+    assert 'tests_checkmodel6' not in str(objs.query)
+    with CaptureQueriesContext(connection) as queries:
+        pks = list(perms_filter_pks(user, ('check7.detail',),
+                                    CheckModel7.objects.order_by('pk')))
+    assert pks == expected
+    assert not any('tests_checkmodel6' in q['sql'] for q in queries)
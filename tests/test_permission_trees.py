@@ -1,4 +1,5 @@
 import json
+import pickle
 from tutelary.engine import PermissionTree, PolicyBody, Action, Object
 from .datadir import datadir  # noqa
 
@@ -121,3 +122,163 @@ def test_permission_set_policies_4():
     user_list = Action('project.users.list')
     proj = Object('project/Cadasta/TestProj')
     assert pset.allow(user_list, proj)
+
+
+def test_permission_tree_from_policies(datadir):  # noqa
+    v = {'organisation': 'Cadasta', 'project': 'Test'}
+    pnames = ['default-policy.json', 'org-policy.json', 'project-policy.json',
+              'data-collector-policy.json']
+    pols = [PolicyBody(json=datadir.join(f).read(), variables=v)
+            for f in pnames]
+    bulk = PermissionTree.from_policies(pols)
+    incremental = PermissionTree()
+    for pol in pols:
+        for e, a, o in pol:
+            incremental.add(e, a, o)
+    assert bulk.tree == incremental.tree
+    assert bulk.allow(Action('parcel.edit'),
+                      Object('Cadasta/Test/parcel/123'))
+    assert not bulk.allow(Action('party.create'),
+                          Object('Cadasta/Test/party'))
+
+
+def test_permission_tree_from_policies_many_objects():
+    clause = {
+        "clause": [
+            {
+                "effect": "allow",
+                "object": ["Cadasta/*/parcel/*"],
+                "action": ["parcel.*"]
+            },
+            {
+                "effect": "deny",
+                "object": ["Cadasta/Test/parcel/" + str(i)
+                           for i in range(2000)],
+                "action": ["parcel.edit", "parcel.delete"]
+            },
+            {
+                "effect": "allow",
+                "object": ["Cadasta/Test/parcel/*"],
+                "action": ["parcel.delete"]
+            }
+        ]
+    }
+    pset = PermissionTree.from_policies([PolicyBody(json=json.dumps(clause))])
+    assert len(pset.tree) == 2002
+    assert not pset.allow(Action('parcel.edit'),
+                          Object('Cadasta/Test/parcel/123'))
+    assert pset.allow(Action('parcel.delete'),
+                      Object('Cadasta/Test/parcel/123'))
+    assert pset.allow(Action('parcel.edit'),
+                      Object('Cadasta/Test/parcel/2000'))
+    # Both actions of the second clause were given the same object
+    # subtree, which the third clause then replaced for one of them.
+    assert len(pset.compile().compiled.items) < 2100
+
+
+def test_permission_tree_compile(datadir):  # noqa
+    v = {'organisation': 'Cadasta', 'project': 'Test'}
+    pnames = ['default-policy.json', 'org-policy.json', 'project-policy.json',
+              'org-admin-policy.json']
+    pols = [PolicyBody(json=datadir.join(f).read(), variables=v)
+            for f in pnames]
+    pset = PermissionTree(policies=pols)
+    compiled = pickle.loads(pickle.dumps(PermissionTree(policies=pols)
+                                         .compile()))
+    assert compiled.compiled is not None
+    checks = [(Action('parcel.view'), Object('Cadasta/Test/parcel/123')),
+              (Action('parcel.edit'), Object('Cadasta/Test/parcel/123')),
+              (Action('party.create'), Object('Cadasta/Test/party')),
+              (Action('admin.assign-role'), Object('user/iross')),
+              (Action('admin.invite'), Object('org/Cadasta')),
+              (Action('statistics'), None)]
+    for a, o in checks:
+        assert compiled.allow(a, o) == pset.allow(a, o)
+    assert compiled.tree == pset.tree
+
+    compiled.add('deny', Action('parcel.view'),
+                 Object('Cadasta/Test/parcel/123'))
+    assert compiled.compiled is None
+    assert not compiled.allow(Action('parcel.view'),
+                              Object('Cadasta/Test/parcel/123'))
+
+
+def test_permission_tree_bytes(datadir):  # noqa
+    v = {'organisation': 'Cadasta', 'project': 'Test'}
+    pnames = ['default-policy.json', 'org-policy.json', 'project-policy.json',
+              'org-admin-policy.json']
+    pols = [PolicyBody(json=datadir.join(f).read(), variables=v)
+            for f in pnames]
+    pset = PermissionTree(policies=pols)
+    data = pset.to_bytes()
+    assert pset.compiled is None
+    loaded = PermissionTree.from_bytes(data, memo_size=10)
+    assert loaded.memo_info().maxsize == 10
+    assert loaded.to_bytes() == data
+    assert loaded.tree == pset.tree
+    assert len(data) < len(pset.tree.to_json())
+    assert len(data) < len(pickle.dumps(pset))
+
+
+def test_permission_tree_add_to_loaded(datadir):  # noqa
+    v = {'organisation': 'Cadasta', 'project': 'Test'}
+    pols = [PolicyBody(json=datadir.join(f).read(), variables=v)
+            for f in ['default-policy.json', 'org-policy.json']]
+    pset = PermissionTree(policies=pols).compile()
+    act, obj = Action('a.b'), Object('x/y')
+    for loaded in (pickle.loads(pickle.dumps(pset)),
+                   PermissionTree.from_bytes(pset.to_bytes(), memo_size=10)):
+        assert loaded._tree is None
+        loaded.add('allow', act, obj)
+        assert loaded.compiled is None
+        assert loaded.allow(act, obj)
+        loaded.add('deny', act, obj)
+        assert not loaded.allow(act, obj)
+        assert loaded.tree[act.components + obj.components] == 'deny'
+        del loaded.tree[act.components + obj.components]
+        assert loaded.tree == pset.tree
+
+
+def test_permission_tree_allow_many(datadir):  # noqa
+    v = {'organisation': 'Cadasta', 'project': 'Test'}
+    pnames = ['default-policy.json', 'org-policy.json', 'project-policy.json',
+              'data-collector-policy.json']
+    pols = [PolicyBody(json=datadir.join(f).read(), variables=v)
+            for f in pnames]
+    pset = PermissionTree(policies=pols)
+    pairs = [(Action(a), Object(o) if o is not None else None)
+             for a in ['parcel.view', 'parcel.edit', 'party.create',
+                       'admin.invite', 'statistics']
+             for o in ['Cadasta/Test/parcel/123', 'Cadasta/Test/parcel/124',
+                       'Cadasta/Test/party', 'Cadasta/Other/parcel/1',
+                       'org/Cadasta', 'user/iross', None]]
+    assert pset.allow_many(pairs) == [pset.allow(a, o) for a, o in pairs]
+    assert pset.allow_many([]) == []
+
+
+def test_permission_tree_memo(datadir):  # noqa
+    pol = PolicyBody(json=datadir.join('test-policy-1.json').read())
+    pset = PermissionTree(policies=[pol], memo_size=2)
+    parcel_view = Action('parcel.view')
+    parcel_edit = Action('parcel.edit')
+    parcel123 = Object('Cadasta/Batangas/parcel/123')
+    parcel124 = Object('Cadasta/Batangas/parcel/124')
+
+    assert pset.allow(parcel_view, parcel123)
+    assert pset.allow(parcel_view, parcel123)
+    assert not pset.allow(parcel_edit, parcel123)
+    assert pset.memo_info() == (1, 2, 2, 2)
+    assert pset.allow_many([(parcel_view, parcel124),
+                            (parcel_edit, parcel123)]) == [True, False]
+    assert pset.memo_info() == (2, 3, 2, 2)
+    assert pset.allow(parcel_view, parcel123)
+    assert pset.memo_info() == (2, 4, 2, 2)
+
+    pset.add('allow', parcel_edit, parcel123)
+    assert pset.memo_info().currsize == 0
+    assert pset.allow(parcel_edit, parcel123)
+
+    unpickled = pickle.loads(pickle.dumps(pset.compile()))
+    assert unpickled.memo_info() == (0, 0, 2, 0)
+    assert unpickled.allow(parcel_edit, parcel123)
+    assert PermissionTree().memo_info() is None
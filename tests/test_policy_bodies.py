@@ -1,4 +1,6 @@
-from tutelary.engine import Clause, PolicyBody, Action, Object
+from tutelary.engine import (
+    Clause, PolicyBody, Action, Object, strip_comments
+)
 from tutelary.exceptions import (
     EffectException, PatternOverlapException,
     PolicyBodyException, VariableSubstitutionException
@@ -27,6 +29,27 @@ def test_clause_creation_pattern_overlaps():
         assert c3.effect == 'allow'
 
 
+def test_clause_creation_pattern_overlap_reporting():
+    with pytest.raises(PatternOverlapException) as exc:
+        Clause('allow',
+               [Action('parcel.edit')],
+               [Object('Cadasta/Batangas/parcel/' + str(i))
+                for i in range(10000)] +
+               [Object('Cadasta/Batangas/party/*'),
+                Object('Cadasta/*/parcel/17')])
+    assert exc.value.patterns == (Object('Cadasta/*/parcel/17'),
+                                  Object('Cadasta/Batangas/parcel/17'))
+    assert str(exc.value) == ("overlapping object patterns in policy clause: "
+                              "'Cadasta/*/parcel/17' and "
+                              "'Cadasta/Batangas/parcel/17'")
+    c = Clause('allow',
+               [Action('parcel.edit'), Action('parcel.edit'),
+                Action('party.*')],
+               [Object('Cadasta/*/parcel/*'), Object('Cadasta/*/party/*'),
+                Object('Cadasta/*/parcel')])
+    assert len(c.object) == 3
+
+
 def test_clause_creation_effect_exception():
     with pytest.raises(EffectException):
         c4 = Clause('allows',
@@ -87,3 +110,25 @@ def test_policy_iteration(datadir):  # noqa
         else:
             assert a == Action('*.edit')
         i += 1
+
+
+def test_policy_comments():
+    p = PolicyBody(json='''{
+      "version": "2015-12-10",  // trailing comment
+      # line comment with "quotes"
+      "clause": [
+        { "effect": "allow", "action": [ "parcel.#view" ],
+          "object": [ "Cadasta//parcel/#1" ] } # with a "string
+      ]
+    }''')
+    assert p[0].action == [Action('parcel.#view')]
+    assert p[0].object == [Object('Cadasta//parcel/#1')]
+
+
+def test_policy_comments_linear_time():
+    # Inputs that caused heavy backtracking in the old line-by-line
+    # regexp comment stripper.
+    text = (' ' * 10000 + 'x') * 10 + ' // comment'
+    assert strip_comments(text) == (' ' * 10000 + 'x') * 10 + ' '
+    text = '"' + '\\\\x' * 100000 + '# not a comment'
+    assert strip_comments(text) == text
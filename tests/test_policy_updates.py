@@ -1,5 +1,5 @@
 from tutelary.models import (
-    PermissionSet, Policy, PolicyInstance
+    PermissionSet, Policy, PolicyInstance, policy_body, pset_fingerprint
 )
 from tutelary.engine import Object
 from django.contrib.auth.models import User
@@ -107,3 +107,50 @@ def test_policy_update_2(datadir, setup):  # noqa
     assert user3.has_perm('parcel.view', obj2)
     assert not user3.has_perm('parcel.view', obj3)
     assert user3.has_perm('party.view', obj4)
+
+
+def test_policy_body_cache(datadir, setup):  # noqa
+    user1, user2, user3, def_pol, org_pol, prj_pol = setup
+
+    # Permission sets share parsed policy bodies for identical policy
+    # instances, whatever the formatting of the variable assignments.
+    pb = policy_body(prj_pol.body,
+                     '{"organisation": "Cadasta", "project": "TestProj"}')
+    assert pb is policy_body(prj_pol.body,
+                             '{"project":"TestProj","organisation":"Cadasta"}')
+    assert pb is not policy_body(prj_pol.body,
+                                 '{"organisation": "Cadasta", '
+                                 '"project": "Other"}')
+    assert policy_body(def_pol.body, '{}') is policy_body(def_pol.body, '{}')
+
+    # Saving a policy drops cached bodies.
+    def_pol.save()
+    assert pb is not policy_body(prj_pol.body,
+                                 '{"organisation": "Cadasta", '
+                                 '"project": "TestProj"}')
+
+
+def test_permission_set_sharing(datadir, setup):  # noqa
+    user1, user2, user3, def_pol, org_pol, prj_pol = setup
+
+    # Users with the same policy instances, in the same order, share a
+    # permission set, whatever the formatting of the variables...
+    user4 = UserFactory.create(username='user4')
+    user4.assign_policies(def_pol, (org_pol, {'organisation': 'Cadasta'}))
+    assert user4.permissionset.first() == user2.permissionset.first()
+    check(nuser=4, npol=3, npolin=6, npset=3)
+    pset = user3.permissionset.first()
+    assert pset.fingerprint == pset_fingerprint([
+        (def_pol.pk, '{}', None),
+        (org_pol.pk, '{"organisation":"Cadasta"}', None),
+        (prj_pol.pk, '{"project": "TestProj", "organisation": "Cadasta"}',
+         None)
+    ])
+
+    # ... but a different order gives a different permission set.
+    user4.assign_policies((org_pol, {'organisation': 'Cadasta'}), def_pol)
+    assert user4.permissionset.first() != user2.permissionset.first()
+    check(nuser=4, npol=3, npolin=8, npset=4)
+    assert ([pi.policy for pi in
+             user4.permissionset.first().policyinstance_set.all()] ==
+            [org_pol, def_pol])
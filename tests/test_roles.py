@@ -1,4 +1,6 @@
-from tutelary.models import (assign_user_policies, Role)
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from tutelary.models import (assign_user_policies, Role, PermissionSet)
 from tutelary.engine import Object, Action
 from tutelary.exceptions import RoleVariableException
 import pytest
@@ -132,3 +134,38 @@ def test_roles_policies_roundtripping(datadir, setup):  # noqa
     assert(len(u2.assigned_policies()) == 2)
     u2.assign_policies(def_pol, org_role, testproj_proj_role)
     assert(len(u2.assigned_policies()) == 3)
+
+
+def test_roles_assignment_queries(datadir, setup):  # noqa
+    u1, u2, u3, u4, u5, def_pol, org_pol, prj_pol, deny_pol = setup
+
+    for i in range(10):
+        Role.objects.create(
+            name='proj' + str(i), policies=[def_pol, org_pol, prj_pol],
+            variables={'organisation': 'Cadasta', 'project': str(i)}
+        )
+    u1.assign_policies(def_pol, *Role.objects.all())
+    pset = u1.permissionset.first()
+    assert pset.policyinstance_set.count() == 31
+
+    # Policies for all roles are fetched in one query, then the
+    # permission set is found with one more.
+    roles = list(Role.objects.all())
+    with CaptureQueriesContext(connection) as queries:
+        assert PermissionSet.objects.by_policies_and_roles(
+            [def_pol] + roles
+        ) == pset
+    assert len(queries) == 2
+
+    # Policies are cached on the role instances.
+    with CaptureQueriesContext(connection) as queries:
+        assert PermissionSet.objects.by_policies_and_roles(
+            [def_pol] + roles
+        ) == pset
+    assert len(queries) == 1
+
+    roles = list(Role.objects.all())
+    with CaptureQueriesContext(connection) as queries:
+        u2.assign_policies(def_pol, *roles)
+    assert len(queries) == 6
+    assert u2.permissionset.first() == pset
@@ -0,0 +1,377 @@
+import json
+import threading
+import time
+
+import pytest
+from django.core.cache import cache, caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from tutelary.engine import Action, Object, PermissionTree
+from tutelary.lru import LRUCache
+from tutelary.models import (
+    Policy, PermissionSet, cache_get_tree, cache_set_tree,
+    clear_local_tree_cache, local_tree_cache, TREE_GENERATION_KEY,
+    TREE_CACHE_VERSION
+)
+from .factories import UserFactory
+
+
+@pytest.fixture(scope="function")
+def setup(db, settings):
+    settings.CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'tutelary-test-tree-cache'
+        }
+    }
+    settings.TUTELARY_CACHE_COMPRESS_THRESHOLD = 1024
+    settings.TUTELARY_CACHE_CHUNK_SIZE = 512
+    cache.clear()
+    clear_local_tree_cache()
+    body = json.dumps({'clause': [
+        {'effect': 'allow', 'action': ['parcel.*'],
+         'object': ['Cadasta/*/parcel/*']},
+        {'effect': 'deny', 'action': ['parcel.edit'],
+         'object': ['Cadasta/Test/parcel/' + str(i) for i in range(2000)]}
+    ]})
+    pol = Policy.objects.create(name='big', body=body)
+    user = UserFactory.create(username='user1')
+    user.assign_policies(pol)
+    pset = PermissionSet.objects.get(users=user)
+    yield pset
+    cache.clear()
+    clear_local_tree_cache()
+
+
+def check_tree(ptree):
+    assert ptree.allow(Action('parcel.view'), Object('Cadasta/Test/parcel/1'))
+    assert not ptree.allow(Action('parcel.edit'),
+                           Object('Cadasta/Test/parcel/1'))
+    assert ptree.allow(Action('parcel.edit'),
+                       Object('Cadasta/Test/parcel/2001'))
+
+
+def test_tree_cache_chunked(setup):
+    pset = setup
+    check_tree(pset.tree())
+    entry = cache.get(pset.cache_key())
+    assert entry['zlib']
+    assert len(entry['chunks']) > 1
+    assert all(len(cache.get(k)) <= 512 for k in entry['chunks'])
+    check_tree(cache_get_tree(pset.cache_key()))
+
+
+def test_tree_cache_small_uncompressed(setup, settings):
+    settings.TUTELARY_CACHE_COMPRESS_THRESHOLD = 10 ** 7
+    settings.TUTELARY_CACHE_CHUNK_SIZE = 10 ** 7
+    pset = setup
+    ptree = pset.tree()
+    entry = cache.get(pset.cache_key())
+    assert not entry['zlib']
+    assert entry['data'] == ptree.to_bytes()
+    check_tree(cache_get_tree(pset.cache_key()))
+
+
+def test_tree_cache_missing_or_corrupt_chunk(setup):
+    pset = setup
+    key = pset.cache_key()
+    ptree = pset.tree()
+    chunks = cache.get(key)['chunks']
+
+    cache.delete(chunks[-1])
+    assert cache_get_tree(key) is None
+    check_tree(pset.tree())
+
+    chunks = cache.get(key)['chunks']
+    data = cache.get(chunks[0])
+    cache.set(chunks[0], data[:-1] + bytes([data[-1] ^ 1]))
+    assert cache_get_tree(key) is None
+    check_tree(pset.tree())
+
+    # Old-format cache values are treated as misses.
+    cache.set(key, ptree)
+    assert cache_get_tree(key) is None
+    cache_set_tree(key, ptree)
+    check_tree(cache_get_tree(key))
+
+
+def test_tree_cache_refresh(setup):
+    pset = setup
+    pset.tree()
+    pset.refresh()
+    assert cache_get_tree(pset.cache_key()) is None
+    check_tree(pset.tree())
+
+
+def test_local_tree_cache(setup, settings):
+    pset = setup
+    assert local_tree_cache() is None
+    assert pset.tree() is not pset.tree()
+
+    settings.TUTELARY_LOCAL_TREE_CACHE_SIZE = 10 ** 6
+    ptree = pset.tree()
+    check_tree(ptree)
+    assert pset.tree() is ptree
+    assert local_tree_cache().currsize == len(ptree.to_bytes())
+
+    # A local entry stays in use while the shared tree is missing...
+    cache.delete(pset.cache_key())
+    assert pset.tree() is ptree
+
+    # ... but not once another process changes the generation counter.
+    cache.incr(TREE_GENERATION_KEY)
+    ptree2 = pset.tree()
+    assert ptree2 is not ptree
+    check_tree(ptree2)
+    assert pset.tree() is ptree2
+
+    pset.refresh()
+    assert pset.tree() is not ptree2
+
+    # Trees that are too big for the local cache aren't kept.
+    settings.TUTELARY_LOCAL_TREE_CACHE_SIZE = 100
+    assert pset.tree() is not pset.tree()
+    assert len(local_tree_cache()) == 0
+
+
+def test_tree_cache_generations(setup, monkeypatch):
+    pset = setup
+    key = pset.cache_key()
+    assert key.startswith('tutelary:ptree:{}:'.format(TREE_CACHE_VERSION))
+    check_tree(pset.tree())
+
+    # Assigning users to existing permission sets doesn't invalidate
+    # their trees.
+    pol = Policy.objects.get(name='big')
+    others = [UserFactory.create(username='user' + str(i))
+              for i in range(2, 12)]
+    for i, user in enumerate(others):
+        user.assign_policies(pol, (pol, {'n': str(i)}))
+    user = UserFactory.create(username='user12')
+    user.assign_policies(pol)
+    assert pset.cache_key() == key
+    assert cache_get_tree(key) is not None
+    assert PermissionSet.objects.count() == 11
+    for other in others:
+        other.permset_tree.allow(Action('parcel.view'),
+                                 Object('Cadasta/Test/parcel/1'))
+
+    # Changing a policy invalidates all trees with a constant number
+    # of cache writes.
+    writes = []
+    backend = caches['default']
+    for name in ('set', 'add', 'incr', 'delete', 'set_many', 'delete_many'):
+        def wrap(f, name=name):
+            return lambda *args, **kwargs: (writes.append(name),
+                                            f(*args, **kwargs))[1]
+        monkeypatch.setattr(backend, name, wrap(getattr(backend, name)))
+    pol.body = json.dumps({'clause': [
+        {'effect': 'allow', 'action': ['parcel.*'],
+         'object': ['Cadasta/*/parcel/*']}
+    ]})
+    pol.save()
+    assert writes == ['incr']
+    assert pset.cache_key() != key
+    assert cache_get_tree(pset.cache_key()) is None
+    assert pset.tree().allow(Action('parcel.edit'),
+                             Object('Cadasta/Test/parcel/1'))
+
+
+def test_tree_rebuild_lock(setup, settings, monkeypatch):
+    pset = setup
+    settings.TUTELARY_TREE_LOCK_WAIT = 0.2
+    key = pset.cache_key()
+    lock_key = key + ':lock'
+
+    # The lock is released after building.
+    check_tree(pset.tree())
+    assert cache.get(lock_key) is None
+
+    # Another process is building the tree: wait for it.
+    ptree = cache_get_tree(key)
+    cache.delete(key)
+    cache.add(lock_key, True)
+    sleeps = []
+
+    def sleep(t):
+        sleeps.append(t)
+        if len(sleeps) == 2:
+            cache_set_tree(key, ptree)
+    monkeypatch.setattr(time, 'sleep', sleep)
+    check_tree(pset.tree())
+    assert len(sleeps) == 2
+    assert cache.get(lock_key)
+    monkeypatch.undo()
+
+    # The other process takes too long: build here.
+    cache.delete(key)
+    start = time.monotonic()
+    check_tree(pset.tree())
+    assert time.monotonic() - start >= 0.2
+    assert cache_get_tree(key) is not None
+
+
+def test_tree_rebuild_lock_expired(setup, monkeypatch):
+    pset = setup
+    lock_key = pset.cache_key() + ':lock'
+
+    # The lock expires during a slow build and is taken by another
+    # process, whose lock mustn't be released here.
+    from_policies = PermissionTree.from_policies
+
+    def slow_build(*args, **kwargs):
+        assert cache.get(lock_key) is not None
+        cache.set(lock_key, 'other')
+        return from_policies(*args, **kwargs)
+    monkeypatch.setattr(PermissionTree, 'from_policies', slow_build)
+    check_tree(pset.tree())
+    assert cache.get(lock_key) == 'other'
+
+
+def test_tree_rebuild_stale(setup, settings):
+    pset = setup
+    settings.TUTELARY_LOCAL_TREE_CACHE_SIZE = 10 ** 6
+    settings.TUTELARY_TREE_LOCK_WAIT = 0
+    ptree = pset.tree()
+
+    # The previous tree is used while another process rebuilds the
+    # tree after a policy change...
+    Policy.objects.get(name='big').save()
+    lock_key = pset.cache_key() + ':lock'
+    cache.add(lock_key, True)
+    assert pset.tree() is ptree
+    cache.delete(lock_key)
+    ptree2 = pset.tree()
+    assert ptree2 is not ptree
+    check_tree(ptree2)
+
+    # ... but not after a permission set is deleted.
+    user = UserFactory.create(username='user2')
+    user.assign_policies()
+    user.assign_policies(Policy.objects.get(name='big'))
+    Policy.objects.get(name='big').save()
+    cache.add(pset.cache_key() + ':lock', True)
+    ptree3 = pset.tree()
+    assert ptree3 is not ptree2
+    check_tree(ptree3)
+
+
+def test_stored_tree(setup, settings):
+    pset = setup
+    settings.TUTELARY_STORE_TREES = True
+    ptree = pset.tree()
+    assert 'stored_tree' in PermissionSet.objects.get(
+        pk=pset.pk
+    ).get_deferred_fields()
+    data, fingerprint = PermissionSet.objects.filter(pk=pset.pk).values_list(
+        'stored_tree', 'stored_tree_fingerprint'
+    ).get()
+    assert bytes(data) == ptree.to_bytes()
+    assert fingerprint == '{}:'.format(TREE_CACHE_VERSION)
+
+    # After a cache flush, the tree is read from the database.
+    cache.clear()
+    with CaptureQueriesContext(connection) as queries:
+        check_tree(pset.tree())
+    assert len(queries) == 1
+    assert cache_get_tree(pset.cache_key()) is not None
+
+    # Policy changes clear stored trees.
+    pol = Policy.objects.get(name='big')
+    pol.body = json.dumps({'clause': [
+        {'effect': 'allow', 'action': ['parcel.*'],
+         'object': ['Cadasta/*/parcel/*']}
+    ]})
+    pol.save()
+    data, fingerprint = PermissionSet.objects.filter(pk=pset.pk).values_list(
+        'stored_tree', 'stored_tree_fingerprint'
+    ).get()
+    assert data is None
+    assert not fingerprint.startswith('{}:'.format(TREE_CACHE_VERSION))
+    assert pset.tree().allow(Action('parcel.edit'),
+                             Object('Cadasta/Test/parcel/1'))
+    assert PermissionSet.objects.filter(
+        pk=pset.pk, stored_tree__isnull=False
+    ).exists()
+
+    # Stored trees in an old format are rebuilt.
+    PermissionSet.objects.filter(pk=pset.pk).update(
+        stored_tree=b'junk', stored_tree_fingerprint='0:x'
+    )
+    cache.clear()
+    assert pset.tree().allow(Action('parcel.edit'),
+                             Object('Cadasta/Test/parcel/1'))
+
+
+def test_stored_tree_cleared_during_build(setup, settings, monkeypatch):
+    pset = setup
+    settings.TUTELARY_STORE_TREES = True
+    pol = Policy.objects.get(name='big')
+
+    # The policy is changed while the tree is being built from the old
+    # policy body: the old tree mustn't be stored.
+    from_policies = PermissionTree.from_policies
+
+    def change_policy(*args, **kwargs):
+        monkeypatch.undo()
+        pol.body = json.dumps({'clause': [
+            {'effect': 'allow', 'action': ['parcel.*'],
+             'object': ['Cadasta/*/parcel/*']}
+        ]})
+        pol.save()
+        return from_policies(*args, **kwargs)
+    monkeypatch.setattr(PermissionTree, 'from_policies', change_policy)
+    check_tree(pset.tree())
+    assert PermissionSet.objects.filter(
+        pk=pset.pk, stored_tree__isnull=True
+    ).exists()
+
+    cache.clear()
+    assert pset.tree().allow(Action('parcel.edit'),
+                             Object('Cadasta/Test/parcel/1'))
+
+
+def test_lru_cache_sizes():
+    lru = LRUCache(10)
+    lru.put('a', 1, 4)
+    lru.put('b', 2, 4)
+    assert lru.get('a') == 1
+    lru.put('c', 3, 4)
+    assert 'b' not in lru and 'a' in lru and 'c' in lru
+    assert lru.info().currsize == 8
+    lru.put('a', 4, 2)
+    assert lru.info().currsize == 6
+    lru.put('d', 5, 11)
+    assert 'd' not in lru
+    assert lru.pop('c') == 3
+    assert lru.info().currsize == 2
+    lru.clear()
+    assert lru.info().currsize == 0
+
+
+def test_lru_cache_threads():
+    # Permission trees in the process-local cache (and their memos)
+    # are shared between threads.
+    lru = LRUCache(50)
+    errors = []
+
+    def worker(n):
+        try:
+            for i in range(20000):
+                key = (n * i) % 97
+                if lru.get(key) is None:
+                    lru.put(key, i, 1 + i % 3)
+                if i % 101 == 0:
+                    lru.pop(key)
+        except Exception as exc:
+            errors.append(exc)
+    threads = [threading.Thread(target=worker, args=(n,))
+               for n in range(1, 9)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert lru.info().currsize == sum(lru.sizes.values()) <= 50
+    assert set(lru.sizes) == set(lru.data)
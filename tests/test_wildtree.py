@@ -1,5 +1,6 @@
+import pickle
 import pytest
-from tutelary.wildtree import WildTree
+from tutelary.wildtree import WildTree, CompiledWildTree
 
 
 def test_wildtree_1():
@@ -74,3 +75,140 @@ def test_wildtree_5():
     with pytest.raises(KeyError):
         assert t[('a', 'x', 'f')] == 1
     assert WildTree(json=t.to_json()) == t
+
+
+def test_wildtree_6():
+    t = WildTree()
+    t[('a', 'b', 'c')] = 1
+    t[('a', '*', 'c')] = 2
+    t[('a', 'b', 'd')] = 3
+    t[('a', 'b', 'c')] = 4
+    assert len(t) == 3
+    assert t[('a', 'b', 'c')] == 4
+    assert t[('a', 'b', 'd')] == 3
+    assert t[('a', 'x', 'c')] == 2
+    del t[('a', '*', 'c')]
+    assert t[('a', 'b', 'c')] == 4
+    with pytest.raises(KeyError):
+        assert t[('a', 'x', 'c')] == 2
+    assert WildTree(json=t.to_json()) == t
+
+
+def test_wildtree_many_siblings():
+    t = WildTree()
+    for i in range(1000):
+        t[('parcel', str(i))] = i
+    t[('parcel', '*')] = -1
+    t[('parcel', '17')] = 17
+    assert len(t) == 2
+    assert t[('parcel', '17')] == 17
+    assert t[('parcel', '18')] == -1
+
+
+def test_wildtree_list_json():
+    old = ('{"item": null, "subtrees": [["a", {"item": null, "subtrees": ' +
+           '[["b", {"item": 3, "subtrees": []}], ' +
+           '["*", {"item": 2, "subtrees": []}], ' +
+           '["b", {"item": null, "subtrees": ' +
+           '[["c", {"item": 1, "subtrees": []}]]}]]}]]}')
+    t = WildTree(json=old)
+    assert t[('a', 'b')] == 3
+    assert t[('a', 'x')] == 2
+    assert t[('a', 'b', 'c')] == 1
+    assert len(t) == 3
+
+
+def test_wildtree_get():
+    t = WildTree()
+    t[('a', '*', 'c')] = 1
+    t[('a', 'b', 'd')] = 2
+    assert t.get(('a', 'b', 'c')) == 1
+    assert t.get(('a', 'b', 'd')) == 2
+    assert t.get(('a', 'b', 'e')) is None
+    assert t.get(('a', 'b', 'e'), 3) == 3
+    assert t.find(('a', 'b', 'c'))[0] == 1
+    with pytest.raises(KeyError):
+        t.find(('a', 'b', 'c'), perfect=True)
+
+
+def test_wildtree_alternatives():
+    t = WildTree()
+    t[('a', '*', 'c')] = 1
+    t[('a', 'b', 'c')] = 2
+    t[('a', 'd', 'c')] = 2
+    t[('a', 'e', '*')] = 3
+    alts = t.alternatives(('a', None, 'c'))
+    assert alts[0] == (((1, ('b', 'd')),), 2)
+    for k in ('b', 'd', 'e', 'x'):
+        expected = t.get(('a', k, 'c'))
+        assert next(v for conds, v in alts
+                    if all(k in ks for _, ks in conds)) == expected
+    assert list(t.alternatives(('a', 'x', None))) == [(((2, ('c',)),), 1)]
+    assert not t.alternatives(('x', None))
+
+
+def test_wildtree_set_product():
+    prefixes = [('parcel', 'edit'), ('parcel', 'view'), ('party', '*')]
+    suffixes = [('Cadasta', 'Test', str(i)) for i in range(100)]
+    t1, t2 = WildTree(), WildTree()
+    t1[('*', '*', 'Cadasta', '*', '*')] = 0
+    t2[('*', '*', 'Cadasta', '*', '*')] = 0
+    t1.set_product(prefixes, suffixes, 1)
+    for p in prefixes:
+        for s in suffixes:
+            t2[p + s] = 1
+    assert sorted(t1) == sorted(t2)
+    # The suffix subtree is shared by all the prefixes.
+    assert (t1.root['exact']['parcel']['exact']['edit']['exact']['Cadasta'] is
+            t1.root['exact']['party']['wild']['exact']['Cadasta'])
+
+    # Later changes below one prefix don't affect the others.
+    for t in (t1, t2):
+        t[('parcel', 'edit', 'Cadasta', 'Test', '17')] = 2
+        t[('parcel', 'view', 'Cadasta', '*', '*')] = 3
+        del t[('party', '*', 'Cadasta', 'Test', '18')]
+    t3 = pickle.loads(pickle.dumps(t1))
+    t3[('party', '*', 'Cadasta', 'Test', '19')] = 4
+    for k in [('parcel', 'edit', 'Cadasta', 'Test', '17'),
+              ('parcel', 'edit', 'Cadasta', 'Test', '18'),
+              ('parcel', 'view', 'Cadasta', 'Test', '17'),
+              ('party', 'view', 'Cadasta', 'Test', '17'),
+              ('party', 'view', 'Cadasta', 'Test', '18'),
+              ('party', 'view', 'Cadasta', 'Test', '19')]:
+        assert t1.get(k) == t2.get(k)
+    assert t3[('party', 'view', 'Cadasta', 'Test', '19')] == 4
+    assert t1[('party', 'view', 'Cadasta', 'Test', '19')] == 1
+    assert len(t1) == len(t2)
+
+
+def test_wildtree_bytes():
+    t = WildTree()
+    t[('a', '*', 'c')] = 'allow'
+    t[('a', 'b', 'd')] = 'deny'
+    t[('a', 'b', '*')] = 2
+    t[('*', '*')] = 1.5
+    t2 = WildTree.from_bytes(t.to_bytes())
+    assert t2 == t
+    c = CompiledWildTree.from_bytes(t.to_bytes())
+    assert c.get(('a', 'x', 'c')) == 'allow'
+    assert c.get(('a', 'b', 'c')) == 2
+    assert c.get(('b', 'x')) == 1.5
+    assert c.get(('b', 'x', 'y')) is None
+    assert pickle.loads(pickle.dumps(c)).to_bytes() == t.to_bytes()
+    with pytest.raises(ValueError):
+        CompiledWildTree.from_bytes(b'TWT\x00' + t.to_bytes()[4:])
+    with pytest.raises(ValueError):
+        CompiledWildTree.from_bytes(t.to_bytes()[:-4])
+
+    # Corrupted data is rejected when it's loaded, not when it's used.
+    data = t.to_bytes()
+    for i in range(len(data)):
+        for b in (0, 0xff, data[i] ^ 1, data[i] + 1 & 0xff):
+            corrupt = data[:i] + bytes([b]) + data[i + 1:]
+            try:
+                c = CompiledWildTree.from_bytes(corrupt)
+            except ValueError:
+                continue
+            for key in (('a', 'x', 'c'), ('a', 'b', 'd'), ('b', 'x')):
+                c.get(key)
+            c.to_wildtree()
@@ -12,6 +12,20 @@ class Backend:
     def _obj_ok(obj):
         return obj is None or callable(obj) or isinstance(obj, Object)
 
+    def _perms_obj(self, obj, perm):
+        # Object paths may be given as strings, model instances
+        # providing a permissions object, or Object instances.  Object
+        # strings aren't interned: they're arbitrary and would evict
+        # the (few, frequently used) interned actions.
+        if isinstance(obj, str):
+            return Object(obj)
+        if not self._obj_ok(obj):
+            if hasattr(obj, 'get_permissions_object'):
+                return obj.get_permissions_object(perm)
+            else:
+                raise InvalidPermissionObjectException
+        return obj
+
     def has_perm(self, user, perm, obj=None, *args, **kwargs):
         """Test user permissions for a single action and object.
 
@@ -20,19 +34,34 @@ class Backend:
         :param perm: The action to test.
         :type perm: ``str``
         :param obj: The object path to test.
-        :type obj: ``tutelary.engine.Object``
+        :type obj: ``tutelary.engine.Object`` or ``str``
         :returns: ``bool`` -- is the action permitted?
         """
         try:
-            if not self._obj_ok(obj):
-                if hasattr(obj, 'get_permissions_object'):
-                    obj = obj.get_permissions_object(perm)
-                else:
-                    raise InvalidPermissionObjectException
-            return user.permset_tree.allow(Action(perm), obj)
+            obj = self._perms_obj(obj, perm)
+            return user.permset_tree.allow(Action.get(perm), obj)
         except ObjectDoesNotExist:
             return False
 
+    def has_perms_many(self, user, pairs):
+        """Test user permissions for a sequence of actions and objects in
+        one pass over the user's permission set.
+
+        :param user: The user to test.
+        :type user: ``User``
+        :param pairs: The actions and objects to test, as pairs of
+                      action name and object path (or model instance).
+        :type pairs: ``list((str, tutelary.engine.Object))``
+        :returns: ``list(bool)`` -- is each action permitted?
+        """
+        pairs = list(pairs)
+        try:
+            tests = [(Action.get(perm), self._perms_obj(obj, perm))
+                     for perm, obj in pairs]
+            return user.permset_tree.allow_many(tests)
+        except ObjectDoesNotExist:
+            return [False] * len(pairs)
+
     def permitted_actions(self, user, obj=None):
         """Determine list of permitted actions for an object or object
         pattern.
@@ -1,4 +1,5 @@
 from functools import reduce, wraps
+from operator import attrgetter
 from django.core.exceptions import PermissionDenied
 from django.db import models
 from django.utils.decorators import available_attrs
@@ -40,7 +41,9 @@ def permission_required(*actions, obj=None, raise_exception=False):
 
 def get_path_fields(cls, base=[]):
     """Get object fields used for calculation of django-tutelary object
-    paths.
+    paths.  Where a path field is the primary key of a foreign key's
+    target model, the foreign key's ``_id`` attribute is used instead,
+    so that the related object doesn't need to be loaded.
 
     """
     pfs = []
@@ -50,12 +53,32 @@ def get_path_fields(cls, base=[]):
         else:
             f = cls._meta.get_field(pf)
             if isinstance(f, models.ForeignKey):
-                pfs += get_path_fields(f.target_field.model, base=base + [pf])
+                fk_pfs = get_path_fields(f.target_field.model,
+                                         base=base + [pf])
+                if f.target_field.primary_key:
+                    pk_pf = base + [pf, 'pk']
+                    fk_pfs = [base + [f.attname] if fk_pf == pk_pf else fk_pf
+                              for fk_pf in fk_pfs]
+                pfs += fk_pfs
             else:
                 pfs.append(base + [f.name])
     return pfs
 
 
+def get_related_paths(pfs):
+    """Get the related-field paths (as queryset lookups) followed in
+    calculating django-tutelary object paths from path fields.
+
+    """
+    paths = []
+    for pf in pfs:
+        if not isinstance(pf, str) and len(pf) > 1:
+            path = '__'.join(pf[:-1])
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
 def get_perms_object(obj, action):
     """Get the django-tutelary path for an object, based on the fields
     listed in ``TutelaryMeta.pfs``.
@@ -66,26 +89,182 @@ def get_perms_object(obj, action):
             return pf
         else:
             return str(reduce(lambda o, f: getattr(o, f), pf, obj))
-    return Object([get_one(pf) for pf in obj.__class__.TutelaryMeta.pfs])
+    return Object.from_components(
+        tuple(get_one(pf) for pf in obj.__class__.TutelaryMeta.pfs)
+    )
+
+
+def make_perms_path(cls):
+    """Make a function calculating the django-tutelary paths of instances
+    of a permissioned model, specialised to the model's
+    ``TutelaryMeta.pfs``: the constant prefix of the path and attribute
+    getters for the path fields are set up in advance.
+
+    """
+    prefix = []
+    attrs = []
+    for pf in cls.TutelaryMeta.pfs:
+        if isinstance(pf, str):
+            if attrs:
+                # Constant components only ever come first, but fall
+                # back to the generic version if not.
+                return lambda obj: get_perms_object(obj, None)
+            prefix.append(pf)
+        else:
+            attrs.append('.'.join(pf))
+    prefix = tuple(prefix)
+    if len(attrs) == 0:
+        path = Object.from_components(prefix)
+        return lambda obj: path
+    get = attrgetter(*attrs)
+    if len(attrs) == 1:
+        return lambda obj: Object.from_components(prefix + (str(get(obj)),))
+    return lambda obj: Object.from_components(
+        prefix + tuple(map(str, get(obj)))
+    )
 
 
-def make_get_perms_object(perms_objs):
+def make_get_perms_object(perms_objs, cls=None):
     """Make a function to delegate permission object rendering to some
-    other (foreign key) field of an object.
+    other (foreign key) field of an object.  If a model is given, the
+    paths of its own instances are calculated using the model's
+    ``TutelaryMeta.perms_path``.
 
     """
+    path = (cls.TutelaryMeta.perms_path if cls is not None
+            else lambda obj: get_perms_object(obj, None))
+
     def retfn(obj, action):
         if action in perms_objs:
             if perms_objs[action] is None:
                 return None
             else:
-                return get_perms_object(getattr(obj, perms_objs[action]),
-                                        action)
+                rel = getattr(obj, perms_objs[action])
+                return rel.__class__.TutelaryMeta.perms_path(rel)
         else:
-            return get_perms_object(obj, action)
+            return path(obj)
+    retfn.perms_objs = perms_objs
     return retfn
 
 
+def get_perms_lookups(cls, action):
+    """Describe the django-tutelary paths of the permissions objects of
+    instances of a permissioned model for an action in terms of
+    queryset lookups.  Returns ``None`` if the permissions object is
+    ``None``, and otherwise a pair of an object path pattern, with
+    ``None`` for components taken from fields, and a list of
+    ``(lookup, field)`` pairs for those components.  Returns ``False``
+    if the model's permissions objects aren't made from its path
+    fields.
+
+    """
+    getter = getattr(cls, 'get_permissions_object', None)
+    if getter is get_perms_object:
+        perms_objs = {}
+    else:
+        perms_objs = getattr(getter, 'perms_objs', None)
+        if perms_objs is None:
+            return False
+    base = []
+    if action in perms_objs:
+        if perms_objs[action] is None:
+            return None
+        base = [perms_objs[action]]
+        cls = cls._meta.get_field(perms_objs[action]).related_model
+    pattern = []
+    lookups = []
+    for pf in cls.TutelaryMeta.pfs:
+        if isinstance(pf, str):
+            pattern.append(pf)
+        else:
+            model = cls
+            for f in pf[:-1]:
+                model = model._meta.get_field(f).related_model
+            field = (model._meta.pk if pf[-1] == 'pk'
+                     else model._meta.get_field(pf[-1]))
+            pattern.append(None)
+            lookups.append(('__'.join(base + pf), field))
+    return tuple(pattern), lookups
+
+
+def get_perms_related(cls, actions=None):
+    """Get the related-field paths followed in calculating the
+    permissions objects of instances of a permissioned model for a
+    sequence of actions (by default, all of the model's actions).
+
+    """
+    if actions is None:
+        actions = [a[0] if isinstance(a, tuple) else a
+                   for a in cls.TutelaryMeta.actions]
+    getter = getattr(cls, 'get_permissions_object', None)
+    if getter is get_perms_object:
+        perms_objs = {}
+    else:
+        perms_objs = getattr(getter, 'perms_objs', None)
+        if perms_objs is None:
+            return []
+    paths = []
+    for action in actions:
+        if action not in perms_objs:
+            new = cls.TutelaryMeta.related_paths
+        elif perms_objs[action] is None:
+            new = []
+        else:
+            po = perms_objs[action]
+            related = cls._meta.get_field(po).related_model
+            new = [po] + [po + '__' + p for p in getattr(
+                getattr(related, 'TutelaryMeta', None), 'related_paths', []
+            )]
+        paths += [p for p in new if p not in paths]
+    return paths
+
+
+def select_perms_related(queryset, actions=None):
+    """Apply ``select_related`` to a queryset of instances of a
+    permissioned model for the related objects needed to calculate
+    their permissions objects for a sequence of actions (by default,
+    all of the model's actions), so that checking permissions on the
+    instances doesn't need a query per instance.  Foreign keys deferred
+    in the queryset (with ``only`` or ``defer``) aren't followed.  The
+    queryset is returned unchanged if ``actions`` is ``False`` (no
+    permissions to check).
+
+    """
+    if (actions is False or not hasattr(queryset.model, 'TutelaryMeta') or
+            queryset._fields is not None):
+        return queryset
+    paths = []
+    for path in get_perms_related(queryset.model, actions):
+        path = _undeferred_path(queryset, path)
+        if path and path not in paths:
+            paths.append(path)
+    if len(paths) == 0:
+        return queryset
+    return queryset.select_related(*paths)
+
+
+def _undeferred_path(queryset, path):
+    # Longest prefix of a related-field path that doesn't pass through
+    # fields deferred by ``only`` or ``defer`` (Django doesn't allow
+    # deferred fields to be traversed with ``select_related``).
+    names, defer = queryset.query.deferred_loading
+    segments = path.split('__')
+    for i in range(len(segments)):
+        prefix = '__'.join(segments[:i + 1])
+        if defer:
+            deferred = prefix in names
+        else:
+            parent = '__'.join(segments[:i])
+            restricted = i == 0 or any(n.startswith(parent + '__')
+                                       for n in names)
+            deferred = restricted and not any(
+                n == prefix or n.startswith(prefix + '__') for n in names
+            )
+        if deferred:
+            return '__'.join(segments[:i])
+    return path
+
+
 def permissioned_model(cls, perm_type=None, path_fields=None, actions=None):
     """Function to set up a model for permissioning.  Can either be called
     directly, passing a class and suitable values for ``perm_type``,
@@ -116,6 +295,10 @@ def permissioned_model(cls, perm_type=None, path_fields=None, actions=None):
                                          actions=actions))
         cls.TutelaryMeta.pfs = ([cls.TutelaryMeta.perm_type] +
                                 get_path_fields(cls))
+        cls.TutelaryMeta.related_paths = get_related_paths(
+            cls.TutelaryMeta.pfs
+        )
+        cls.TutelaryMeta.perms_path = make_perms_path(cls)
         perms_objs = {}
         for a in cls.TutelaryMeta.actions:
             an = a
@@ -135,10 +318,7 @@ def permissioned_model(cls, perm_type=None, path_fields=None, actions=None):
                     except:
                         raise PermissionObjectException(po)
                 perms_objs[an] = po
-        if len(perms_objs) == 0:
-            cls.get_permissions_object = get_perms_object
-        else:
-            cls.get_permissions_object = make_get_perms_object(perms_objs)
+        cls.get_permissions_object = make_get_perms_object(perms_objs, cls)
         return cls
     except:
         if added:
@@ -147,7 +327,7 @@ def permissioned_model(cls, perm_type=None, path_fields=None, actions=None):
 
 
 def action_error_message(actions, req_actions, default=None):
-    for req in req_actions:
+    for req in req_actions or ():
         for a in actions:
             if isinstance(a, tuple) and a[0] == req:
                 if 'error_message' in a[1]:
@@ -5,8 +5,10 @@ from json import loads, dumps, JSONDecodeError
 from string import Template
 import hashlib
 from collections import Sequence
+from functools import lru_cache
 
-from .wildtree import WildTree
+from .wildtree import WildTree, CompiledWildTree
+from .lru import LRUCache
 from .exceptions import (
     EffectException,
     PatternOverlapException,
@@ -28,16 +30,43 @@ class SimpleSeparated(Sequence):
     sequences is exact comparison of components; matching between
     wildcarded components can be tested using the ``match`` method.
 
+    Sequences are immutable: components are stored as a tuple and the
+    hash value is computed once, on creation.  Frequently used
+    sequences can be shared by creating them with ``get``.
+
     """
+    __slots__ = ('components', '_hash')
+
     def __init__(self, s):
         if s is None:
-            self.components = []
+            self.components = ()
         elif isinstance(s, str):
-            self.components = self._split_components(s)
+            self.components = tuple(self._split_components(s))
         elif isinstance(s, Sequence):
-            self.components = s
+            self.components = tuple(s)
         else:
             raise ValueError('invalid initialiser for separated sequence')
+        self._hash = hash(self.components)
+
+    @classmethod
+    def get(cls, s):
+        """Interning constructor: return a shared instance for the string
+        ``s``, so that strings used repeatedly are only parsed once.
+
+        """
+        return interned(cls, s)
+
+    @classmethod
+    def from_components(cls, components):
+        """Construct a sequence directly from a tuple of components that
+        have already been split and unescaped.  The input is not
+        checked, so this is only for use with trusted components.
+
+        """
+        seq = cls.__new__(cls)
+        seq.components = components
+        seq._hash = hash(components)
+        return seq
 
     def _split_components(self, s):
         return s.split(self.separator)
@@ -58,7 +87,7 @@ class SimpleSeparated(Sequence):
         return self.components == other.components
 
     def __hash__(self):
-        return hash(str(self))
+        return self._hash
 
     def match(self, other):
         # Two sequences match if they are the same length and
@@ -78,7 +107,13 @@ class EscapeSeparated(SimpleSeparated):
     other escaping mechanism is supported.
 
     """
+    __slots__ = ()
+
     def _split_components(self, s):
+        # Without backslashes there's nothing to unescape, so a plain
+        # split will do (dropping empty components, as the regexp does).
+        if '\\' not in s:
+            return [c for c in s.split(self.separator) if c]
         # Generate regexp lazily for each derived class so that we can
         # compile it.
         if not hasattr(self, 'regex'):
@@ -101,6 +136,8 @@ class Action(SimpleSeparated):
     specified object pattern.
 
     """
+    __slots__ = ()
+
     separator = '.'
 
     registered = set()
@@ -128,6 +165,8 @@ class Object(EscapeSeparated):
     as can backslashes (e.g. ``Cadasta/Village-X\/Y/parcel/943``).
 
     """
+    __slots__ = ()
+
     separator = '/'
 
 
@@ -162,15 +201,77 @@ class Clause:
                    for o in dict['object']] if 'object' in dict else []
         if effect not in ['allow', 'deny']:
             raise EffectException(effect)
-        if any(a1.match(a2) for a1 in act for a2 in act if a1 != a2):
-            raise PatternOverlapException('action')
-        if any(o1.match(o2) for o1 in obj for o2 in obj if o1 != o2):
-            raise PatternOverlapException('object')
+        overlap = find_overlap(act)
+        if overlap is not None:
+            raise PatternOverlapException('action', overlap)
+        overlap = find_overlap(obj)
+        if overlap is not None:
+            raise PatternOverlapException('object', overlap)
         self.effect = effect
         self.action = act
         self.object = obj
 
 
+def find_overlap(patterns):
+    """Find a pair of distinct patterns in a list of action or object
+    patterns that match each other, or return ``None`` if there is no
+    such pair.
+
+    Only pairs involving at least one wildcarded pattern can overlap,
+    so wildcarded patterns are indexed in tries (one per pattern
+    length) and every pattern is checked against the wildcarded
+    patterns before it.  A pattern without wildcards follows at most
+    two branches per component, so explicit lists of objects are
+    checked in close to linear time.
+
+    """
+    literal = {}
+    wild = {}
+    for p in patterns:
+        if '*' in p.components:
+            wild.setdefault(p.components, p)
+        else:
+            literal.setdefault(p.components, p)
+    tries = {}
+    for cs, p in wild.items():
+        trie = tries.setdefault(len(cs), {})
+        other = trie_match(trie, cs)
+        if other is not None:
+            return other, p
+        node = trie
+        for c in cs:
+            node = node.setdefault(c, {})
+        node[None] = p
+    for cs, p in literal.items():
+        other = trie_match(tries.get(len(cs)), cs)
+        if other is not None:
+            return other, p
+    return None
+
+
+def trie_match(trie, cs):
+    """Return a pattern stored in a pattern trie matching the components
+    ``cs``, or ``None``.
+
+    """
+    if trie is None:
+        return None
+    n = len(cs)
+    stack = [(trie, 0)]
+    while stack:
+        node, i = stack.pop()
+        if i == n:
+            return node[None]
+        c = cs[i]
+        if c == '*':
+            stack.extend((child, i + 1) for child in node.values())
+        else:
+            for child in (node.get(c), node.get('*')):
+                if child is not None:
+                    stack.append((child, i + 1))
+    return None
+
+
 class PolicyBody(Sequence):
     """A policy body is just a sequence of clauses, possibly with a name.
     Conversion to and from JSON representations (with
@@ -248,19 +349,109 @@ class PermissionTree:
        a permission tree.
 
     Most of the functionality needed here is implemented in the
-    ``WildTree`` class.
+    ``WildTree`` class.  Once a permission tree is complete, it can be
+    compiled (using ``compile``) into a ``CompiledWildTree`` for
+    faster lookups.  Compiled permission trees are pickled in their
+    compiled form only, using its compact binary encoding, which is
+    also available directly through ``to_bytes`` and ``from_bytes``.
+
+    The results of ``allow`` can optionally be memoised in a
+    size-bounded LRU cache (see ``set_memo_size``), which is emptied
+    whenever the permission tree changes.  The memo contents are not
+    pickled, but its size is.
 
     """
 
-    def __init__(self, policies=None, json=None):
+    def __init__(self, policies=None, json=None, memo_size=0):
         """Permission trees are all by default empty, with an optional list of
         policies added.  They can also be deserialised from JSON.
 
         """
-        self.tree = WildTree(json)
+        self._tree = WildTree(json)
+        self.compiled = None
+        self.set_memo_size(memo_size)
         if policies is not None:
             self.add(policies=policies)
 
+    @property
+    def tree(self):
+        """The ``WildTree`` for the permission tree, decompiled on demand if
+        the permission tree was unpickled in compiled form.
+
+        """
+        if self._tree is None:
+            self._tree = self.compiled.to_wildtree()
+        return self._tree
+
+    def __getstate__(self):
+        state = dict(self.__dict__, memo=None)
+        if self.compiled is not None:
+            state['_tree'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.set_memo_size(self.memo_size)
+
+    def set_memo_size(self, memo_size):
+        """Set the maximum number of ``allow`` results to memoise, or turn
+        memoisation off if ``memo_size`` is zero.  Any existing memo
+        is discarded.
+
+        """
+        self.memo_size = memo_size
+        self.memo = LRUCache(memo_size) if memo_size else None
+
+    def memo_info(self):
+        """Report hit and miss counts and current size of the ``allow``
+        memo, as a ``CacheInfo`` named tuple, or ``None`` if
+        memoisation is turned off.
+
+        """
+        return self.memo.info() if self.memo is not None else None
+
+    def compile(self):
+        """Compile the permission tree for fast lookups by ``allow``.  Any
+        later changes to the permission tree discard the compiled form.
+        Returns the permission tree itself.
+
+        """
+        self.compiled = CompiledWildTree(self.tree)
+        return self
+
+    def to_bytes(self):
+        """Compact binary serialisation of the compiled form of the
+        permission tree (see ``CompiledWildTree.to_bytes``).
+
+        """
+        compiled = self.compiled
+        if compiled is None:
+            compiled = CompiledWildTree(self.tree)
+        return compiled.to_bytes()
+
+    @classmethod
+    def from_bytes(cls, data, memo_size=0):
+        """Deserialisation of a compiled permission tree from its binary
+        representation.
+
+        """
+        ptree = cls(memo_size=memo_size)
+        ptree._tree = None
+        ptree.compiled = CompiledWildTree.from_bytes(data)
+        return ptree
+
+    @classmethod
+    def from_policies(cls, policies):
+        """Bulk construction of a permission tree from an ordered sequence
+        of policies.  Clauses are inserted in a single pass, in order,
+        so the result is identical to adding the policies one at a
+        time.
+
+        """
+        ptree = cls()
+        ptree.add(policies=policies)
+        return ptree
+
     def __repr__(self):
         return '{}(\n{}\n)'.format(
             self.__class__.__name__,
@@ -273,25 +464,72 @@ class PermissionTree:
         triples for a policy or list of policies.
 
         """
+        # Trees loaded in compiled form are rebuilt before the compiled
+        # form is discarded.
+        tree = self.tree
+        self.compiled = None
+        if self.memo is not None:
+            self.memo.clear()
         if policies is not None:
-            for p in policies:
-                self.add(policy=p)
+            add_policies(tree, policies)
         elif policy is not None:
-            for e, a, o in policy:
-                self.add(e, a, o)
+            add_policies(tree, [policy])
         else:
-            objc = obj.components if obj is not None else []
-            self.tree[act.components + objc] = effect
+            objc = obj.components if obj is not None else ()
+            tree[act.components + objc] = effect
 
     def allow(self, act, obj=None):
         """Determine where a given action on a given object is allowed.
 
         """
-        objc = obj.components if obj is not None else []
-        try:
-            return self.tree[act.components + objc] == 'allow'
-        except KeyError:
-            return False
+        objc = obj.components if obj is not None else ()
+        key = act.components + objc
+        if self.memo is not None:
+            ok = self.memo.get(key)
+            if ok is None:
+                ok = self._allow(key)
+                self.memo.put(key, ok)
+            return ok
+        return self._allow(key)
+
+    def _allow(self, key):
+        tree = self.compiled if self.compiled is not None else self.tree
+        return tree.get(key) == 'allow'
+
+    def allow_many(self, pairs):
+        """Determine whether each of a sequence of (action, object) pairs is
+        allowed, returning a list of booleans.  The permission tree is
+        compiled first if necessary, and tests for pairs with common
+        prefixes (e.g. the same action on objects in the same project)
+        share the work of matching the common prefix.
+
+        """
+        if self.compiled is None:
+            self.compile()
+        keys = [act.components + (obj.components if obj is not None else ())
+                for act, obj in pairs]
+        if self.memo is None:
+            return [e == 'allow' for e in self.compiled.get_many(keys)]
+        res = [self.memo.get(key) for key in keys]
+        misses = [i for i, ok in enumerate(res) if ok is None]
+        effects = self.compiled.get_many([keys[i] for i in misses])
+        for i, e in zip(misses, effects):
+            res[i] = e == 'allow'
+            self.memo.put(keys[i], res[i])
+        return res
+
+    def alternatives(self, act, obj=()):
+        """Ordered ``(conditions, effect)`` alternatives for testing an
+        action on objects matching an object pattern, given as a
+        sequence of object path components, with ``None`` for free
+        components (see ``WildTree.alternatives``).  Conditions give
+        positions within the object path.
+
+        """
+        n = len(act.components)
+        return [(tuple((i - n, keys) for i, keys in conds), effect)
+                for conds, effect in
+                self.tree.alternatives(act.components + tuple(obj))]
 
     def permitted_actions(self, obj=None):
         """Determine permitted actions for a given object pattern.
@@ -306,6 +544,33 @@ class PermissionTree:
 #  Utility functions
 #
 
+@lru_cache(maxsize=4096)
+def interned(cls, s):
+    """Shared instances of action and object sequences, keyed by class
+    and string representation.
+
+    """
+    return cls(s)
+
+
+def add_policies(tree, policies):
+    """Insert all the clauses of a sequence of policies into a
+    ``WildTree``.  Each clause is inserted as the product of its action
+    and object patterns, so that the actions of a clause can share a
+    single object subtree.
+
+    """
+    for p in policies:
+        for c in p.clauses:
+            acts = [a.components for a in c.action]
+            if len(c.object) == 0:
+                for a in acts:
+                    tree[a] = c.effect
+            else:
+                tree.set_product(acts, [o.components for o in c.object],
+                                 c.effect)
+
+
 def make_regex(separator):
     """Utility function to create regexp for matching escaped separators
     in strings.
@@ -329,19 +594,15 @@ def escape(s, sep):
     return s.replace("\\", "\\\\").replace(sep, "\\" + sep)
 
 
+COMMENT_RE = re.compile(r'"(?:[^"\\\n]|\\.)*"?|#[^\n]*|//[^\n]*')
+
+
 def strip_comments(text):
-    """Comment stripper for JSON.
+    """Comment stripper for JSON: removes ``#`` and ``//`` comments
+    running to the end of a line, but not comment markers inside
+    strings.  Works in a single pass over the text, and leaves line
+    breaks in place so that JSON error positions are unaffected.
 
     """
-    regex = r'\s*(#|\/{2}).*$'
-    regex_inline = r'(:?(?:\s)*([A-Za-z\d\.{}]*)|((?<=\").*\"),?)(?:\s)*(((#|(\/{2})).*)|)$'  # noqa
-    lines = text.split('\n')
-
-    for index, line in enumerate(lines):
-        if re.search(regex, line):
-            if re.search(r'^' + regex, line, re.IGNORECASE):
-                lines[index] = ""
-            elif re.search(regex_inline, line):
-                lines[index] = re.sub(regex_inline, r'\1', line)
-
-    return '\n'.join(lines)
+    return COMMENT_RE.sub(lambda m: m.group() if m.group()[0] == '"' else '',
+                          text)
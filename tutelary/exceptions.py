@@ -16,10 +16,12 @@ class PatternOverlapException(TutelaryException):
     used in a single policy clause.
 
     """
-    def __init__(self, exc_type):
-        super().__init__(
-            "overlapping " + exc_type + " patterns in policy clause"
-        )
+    def __init__(self, exc_type, patterns=None):
+        msg = "overlapping " + exc_type + " patterns in policy clause"
+        if patterns is not None:
+            msg += ": '{}' and '{}'".format(*patterns)
+        super().__init__(msg)
+        self.patterns = patterns
 
 
 class PolicyBodyException(TutelaryException):
@@ -0,0 +1,85 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class LRUCache:
+    """A size-bounded mapping that evicts the least recently used entry
+    when full, and counts lookup hits and misses so that it can be
+    sized sensibly.  Entries have size one unless given another size
+    when they are added, so the bound can be on the number of entries
+    or on an estimate of the memory they use.  All operations hold a
+    lock, so a cache can be shared between threads (e.g. the ``allow``
+    memo of a permission tree held in the process-local tree cache).
+
+    """
+    def __init__(self, maxsize):
+        self.lock = threading.Lock()
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.data = OrderedDict()
+        self.sizes = {}
+        self.currsize = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        """Look up a key, marking it as most recently used.  Returns
+        ``default`` (and counts a miss) if the key isn't present.
+
+        """
+        with self.lock:
+            value = self.data.get(key, self)
+            if value is self:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.data.move_to_end(key)
+            return value
+
+    def put(self, key, value, size=1):
+        """Add or replace an entry, evicting least recently used entries
+        until the total size of the entries is within the bound.  An
+        entry that is larger than the bound on its own is not added.
+
+        """
+        with self.lock:
+            self._pop(key)
+            if size > self.maxsize:
+                return
+            self.data[key] = value
+            self.sizes[key] = size
+            self.currsize += size
+            while self.currsize > self.maxsize:
+                old, _ = self.data.popitem(last=False)
+                self.currsize -= self.sizes.pop(old)
+
+    def pop(self, key, default=None):
+        with self.lock:
+            return self._pop(key, default)
+
+    def _pop(self, key, default=None):
+        if key in self.data:
+            self.currsize -= self.sizes.pop(key)
+        return self.data.pop(key, default)
+
+    def clear(self):
+        """Remove all entries.  Hit and miss counts are kept."""
+        with self.lock:
+            self.data.clear()
+            self.sizes.clear()
+            self.currsize = 0
+
+    def info(self):
+        """Report cache statistics, in the same form as
+        ``functools.lru_cache``.
+
+        """
+        return CacheInfo(self.hits, self.misses, self.maxsize, self.currsize)
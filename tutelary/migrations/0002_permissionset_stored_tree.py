@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tutelary', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='permissionset',
+            name='stored_tree',
+            field=models.BinaryField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='permissionset',
+            name='stored_tree_fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
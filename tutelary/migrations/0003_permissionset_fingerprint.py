@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+import json
+
+from django.db import migrations, models
+
+
+def pset_fingerprint(policy_instances):
+    # Copy of tutelary.models.pset_fingerprint at the time of this
+    # migration.
+    return hashlib.sha1(json.dumps([
+        (policy, json.dumps(json.loads(variables), sort_keys=True), role)
+        for policy, variables, role in policy_instances
+    ]).encode()).hexdigest()
+
+
+def backfill_fingerprints(apps, schema_editor):
+    # Fingerprint existing permission sets.  If there are duplicate
+    # permission sets, only the oldest gets a fingerprint, so new
+    # assignments are made to it, and the others are left as they are.
+    PermissionSet = apps.get_model('tutelary', 'PermissionSet')
+    PolicyInstance = apps.get_model('tutelary', 'PolicyInstance')
+    instances = {}
+    for pset, policy, variables, role in (
+            PolicyInstance.objects.order_by('pset', 'index')
+            .values_list('pset', 'policy', 'variables', 'role')):
+        instances.setdefault(pset, []).append((policy, variables, role))
+    seen = set()
+    for pset in PermissionSet.objects.order_by('pk').values_list('pk',
+                                                                 flat=True):
+        fingerprint = pset_fingerprint(instances.get(pset, []))
+        if fingerprint not in seen:
+            seen.add(fingerprint)
+            PermissionSet.objects.filter(pk=pset).update(
+                fingerprint=fingerprint
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tutelary', '0002_permissionset_stored_tree'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='permissionset',
+            name='fingerprint',
+            field=models.CharField(editable=False, max_length=40, null=True, unique=True),
+        ),
+        migrations.RunPython(backfill_fingerprints,
+                             migrations.RunPython.noop),
+    ]
@@ -2,10 +2,13 @@ from django.core.exceptions import ImproperlyConfigured, PermissionDenied
 from collections.abc import Sequence
 from django.contrib.auth.views import redirect_to_login
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db.models import QuerySet
 from django.http.response import Http404
 
-from .models import check_perms
-from .decorators import action_error_message
+from .models import (
+    check_perms, check_perms_many, perms_filter_pks, perms_q
+)
+from .decorators import action_error_message, select_perms_related
 
 
 class BasePermissionRequiredMixin:
@@ -47,17 +50,39 @@ class BasePermissionRequiredMixin:
 
     def perms_filter_queryset(self, objs):
         actions = self.get_permission_required()
-        if isinstance(self.permission_filter_queryset, Sequence):
+        if (actions is not False and
+                isinstance(self.permission_filter_queryset, Sequence)):
             actions += tuple(self.permission_filter_queryset)
 
-        def check_one(obj):
+        # Where possible, do the filtering in the database.  (Actions
+        # computed from individual objects need the objects.)
+        if (isinstance(objs, QuerySet) and objs.query.can_filter() and
+                not callable(self.permission_filter_queryset)):
+            q = perms_q(self.request.user, actions, objs.model)
+            if q is not None:
+                self.filtered_queryset = self.get_queryset().filter(
+                    pk__in=objs.filter(q).values('pk')
+                )
+                return
+
+        def obj_actions(obj):
             check_actions = actions
-            if callable(self.permission_filter_queryset):
+            if (check_actions is not False and
+                    callable(self.permission_filter_queryset)):
                 check_actions += self.permission_filter_queryset(self, obj)
-            return check_perms(self.request.user, check_actions,
-                               [obj], self.request.method)
-
-        filtered_pks = [o.pk for o in objs if check_one(o)]
+            return check_actions
+
+        if isinstance(objs, QuerySet):
+            filtered_pks = list(perms_filter_pks(
+                self.request.user,
+                obj_actions if callable(self.permission_filter_queryset)
+                else actions,
+                objs
+            ))
+        else:
+            objs = list(objs)
+            oks = check_perms_many(self.request.user, obj_actions, objs)
+            filtered_pks = [o.pk for o, ok in zip(objs, oks) if ok]
         self.filtered_queryset = self.get_queryset().filter(
             pk__in=filtered_pks
         )
@@ -92,6 +117,10 @@ class PermissionRequiredMixin(BasePermissionRequiredMixin):
                 self.perms_filter_queryset(objs)
             return True
         else:
+            if isinstance(objs, QuerySet):
+                objs = select_perms_related(
+                    objs, self.get_permission_required()
+                )
             return check_perms(self.request.user,
                                self.get_permission_required(),
                                objs, self.request.method)
@@ -158,7 +187,8 @@ class APIPermissionRequiredMixin(BasePermissionRequiredMixin):
                     pass
             if objs == [None]:
                 objs = self.get_queryset()
-            if len(objs) == 0:
+            if (not objs.exists() if isinstance(objs, QuerySet)
+                    else len(objs) == 0):
                 objs = [None]
 
         if (hasattr(self, 'permission_filter_queryset') and
@@ -167,6 +197,10 @@ class APIPermissionRequiredMixin(BasePermissionRequiredMixin):
             if objs != [None]:
                 self.perms_filter_queryset(objs)
         else:
+            if isinstance(objs, QuerySet):
+                objs = select_perms_related(
+                    objs, self.get_permission_required()
+                )
             has_perm = check_perms(self.request.user,
                                    self.get_permission_required(),
                                    objs, self.request.method)
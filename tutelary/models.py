@@ -1,14 +1,28 @@
+import hashlib
+import itertools
 import json
+import random
 import re
-from django.db import models
+import threading
+import time
+import uuid
+import zlib
+import django
+from django.db import models, transaction
 from django.conf import settings
 from django.db.models.signals import pre_delete
 from django.dispatch import receiver
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import (
+    ObjectDoesNotExist, PermissionDenied, ValidationError
+)
+from django.contrib.auth import get_backends
+from django.contrib.auth.backends import ModelBackend
 from django.core.cache import cache
 from audit_log.models.managers import AuditLog
 import tutelary.engine as engine
+from tutelary.backends import Backend
 from tutelary.exceptions import RoleVariableException
+from tutelary.lru import LRUCache
 
 
 class Policy(models.Model):
@@ -33,12 +47,23 @@ class Policy(models.Model):
         return set([m[0] for m in re.findall(pat, self.body)])
 
     def save(self, *args, **kwargs):
+        adding = self._state.adding
         super().save(*args, **kwargs)
-        self.refresh()
+        if not adding:
+            clear_policy_body_cache()
+            self.refresh()
 
     def refresh(self):
-        for pset in _policy_psets([self]):
-            pset.refresh()
+        """Invalidate the permission trees of all permission sets (the
+        single cache write needed for this is cheaper than finding and
+        invalidating the permission sets using the policy), and the
+        stored trees of the permission sets using the policy.  Stored
+        trees are cleared first, so that trees rebuilt for the new
+        generation can't be loaded from them.
+
+        """
+        clear_stored_trees(_policy_psets([self]))
+        bump_tree_generation()
 
 
 class RolePolicyAssign(models.Model):
@@ -75,8 +100,11 @@ class RoleManager(models.Manager):
         variable_names = set().union(*[p.variable_names() for p in policies])
         if not variable_names.issubset(variables.keys()):
             raise RoleVariableException("missing variable in role definition")
-        for i, policy in enumerate(policies):
-            RolePolicyAssign.objects.create(role=role, policy=policy, index=i)
+        RolePolicyAssign.objects.bulk_create([
+            RolePolicyAssign(role=role, policy=policy, index=i)
+            for i, policy in enumerate(policies)
+        ])
+        role._policy_ids = [policy.pk for policy in policies]
         return role
 
 
@@ -162,77 +190,297 @@ def _policy_psets(policy_instances):
             policyinstance__policy__in=policy_instances).distinct()
 
 
+_policy_bodies = None
+_policy_bodies_lock = threading.Lock()
+
+
+def policy_body(body, variables):
+    """Parsed policy body for a policy JSON body and variable assignments
+    (a JSON dump of a dictionary).
+
+    Parsed bodies are kept in a process-wide LRU cache (of size
+    ``TUTELARY_POLICY_CACHE_SIZE``) keyed on a hash of the body and
+    the canonicalised variable assignments, so that permission sets
+    sharing policy instances only parse each distinct instance once.
+
+    """
+    global _policy_bodies
+    variables = json.loads(variables)
+    key = (hashlib.md5(body.encode()).hexdigest(),
+           json.dumps(variables, sort_keys=True))
+    with _policy_bodies_lock:
+        if _policy_bodies is None:
+            _policy_bodies = LRUCache(
+                getattr(settings, 'TUTELARY_POLICY_CACHE_SIZE', 1024)
+            )
+        pb = _policy_bodies.get(key)
+    if pb is None:
+        pb = engine.PolicyBody(json=body, variables=variables)
+        with _policy_bodies_lock:
+            _policy_bodies.put(key, pb)
+    return pb
+
+
+def clear_policy_body_cache():
+    """Drop all cached parsed policy bodies.  Cache keys are derived from
+    policy contents, so this is only needed to release memory held by
+    bodies of policies that have been changed.
+
+    """
+    with _policy_bodies_lock:
+        if _policy_bodies is not None:
+            _policy_bodies.clear()
+
+
+def cache_set_tree(key, ptree):
+    """Store a permission tree in the cache, in its binary encoding.
+
+    Encoded trees larger than ``TUTELARY_CACHE_COMPRESS_THRESHOLD``
+    bytes are compressed.  If they are still larger than
+    ``TUTELARY_CACHE_CHUNK_SIZE`` bytes (so might exceed the cache
+    backend's value size limit), they are split into chunks stored
+    under separate keys, and the main key holds a manifest listing the
+    chunk keys and a digest of the data.  Chunk keys are unique to
+    each write, so chunks from different writes can't be mixed up.
+    Returns the size of the (uncompressed) binary encoding.
+
+    """
+    data = ptree.to_bytes()
+    nbytes = len(data)
+    compressed = len(data) > getattr(
+        settings, 'TUTELARY_CACHE_COMPRESS_THRESHOLD', 16384
+    )
+    if compressed:
+        data = zlib.compress(data)
+    size = getattr(settings, 'TUTELARY_CACHE_CHUNK_SIZE', 1000000)
+    if len(data) <= size:
+        cache.set(key, {'zlib': compressed, 'data': data})
+        return nbytes
+    prefix = '{}:{}:'.format(key, uuid.uuid4().hex)
+    chunks = [(prefix + str(i), data[pos:pos + size])
+              for i, pos in enumerate(range(0, len(data), size))]
+    cache.set_many(dict(chunks))
+    cache.set(key, {'zlib': compressed,
+                    'chunks': [k for k, _ in chunks],
+                    'sha1': hashlib.sha1(data).hexdigest()})
+    return nbytes
+
+
+def cache_get_tree(key):
+    """Retrieve a permission tree stored with ``cache_set_tree``.  Returns
+    ``None`` unless the whole tree can be read back intact.
+
+    """
+    return _cache_get_tree(key)[0]
+
+
+def _cache_get_tree(key):
+    # Retrieved tree and the size of its binary encoding, or (None, 0).
+    entry = cache.get(key)
+    if not isinstance(entry, dict):
+        return None, 0
+    if 'chunks' in entry:
+        chunks = cache.get_many(entry['chunks'])
+        if len(chunks) != len(entry['chunks']):
+            return None, 0
+        data = b''.join(chunks[k] for k in entry['chunks'])
+        if hashlib.sha1(data).hexdigest() != entry['sha1']:
+            return None, 0
+    else:
+        data = entry['data']
+    try:
+        if entry['zlib']:
+            data = zlib.decompress(data)
+        return engine.PermissionTree.from_bytes(
+            data, memo_size=getattr(settings, 'TUTELARY_MEMO_SIZE', 0)
+        ), len(data)
+    except (zlib.error, ValueError):
+        return None, 0
+
+
+TREE_CACHE_VERSION = 1
+"""Version of the format of cached permission trees, included in their
+cache keys."""
+
+TREE_GENERATION_KEY = 'tutelary:ptree:generation'
+PSET_GENERATION_KEY = 'tutelary:ptree:pset-generation'
+TREE_LOCK_POLL_INTERVAL = 0.05
+
+_local_trees = None
+_local_trees_lock = threading.Lock()
+
+
+def tree_generation():
+    """Current values of the permission tree generation counters kept in
+    the shared cache, as a tuple, or ``None`` if the cache doesn't
+    retain them.  The first counter is changed whenever a policy is
+    changed, and is part of the cache keys of all permission trees,
+    so that a policy change invalidates all trees with a single cache
+    write.  The second is changed whenever a single permission set's
+    tree is invalidated.  Both invalidate trees held in process-local
+    caches.  Counters are started from random values so that an
+    evicted counter is never recreated with a value that has already
+    been used.
+
+    """
+    keys = (TREE_GENERATION_KEY, PSET_GENERATION_KEY)
+    generation = cache.get_many(keys)
+    if len(generation) < len(keys):
+        for key in keys:
+            if key not in generation:
+                cache.add(key, random.getrandbits(48), None)
+        generation = cache.get_many(keys)
+        if len(generation) < len(keys):
+            return None
+    return tuple(generation[key] for key in keys)
+
+
+def bump_tree_generation(key=TREE_GENERATION_KEY):
+    """Change a permission tree generation counter (by default, the one
+    invalidating all permission trees).
+
+    """
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, random.getrandbits(48), None)
+
+
+def stored_tree_version():
+    """Fingerprint of permission trees stored in the database that can be
+    used with the current tree format.
+
+    """
+    return '{}:'.format(TREE_CACHE_VERSION)
+
+
+def clear_stored_trees(psets):
+    """Clear the permission trees stored in the database for a queryset
+    of permission sets.  The fingerprints are replaced by a new token
+    (which never matches ``stored_tree_version``), so that trees being
+    built from the old policies when this happens aren't stored: trees
+    are only stored if the fingerprint read before building them is
+    unchanged.
+
+    """
+    PermissionSet.objects.filter(pk__in=psets.values('pk')).update(
+        stored_tree=None, stored_tree_fingerprint='-' + uuid.uuid4().hex
+    )
+
+
+def local_tree_cache():
+    """The process-local permission tree cache, or ``None`` if it is
+    turned off.  Its size bound, ``TUTELARY_LOCAL_TREE_CACHE_SIZE``, is
+    on the total size in bytes of the binary encodings of the cached
+    trees.
+
+    """
+    global _local_trees
+    size = getattr(settings, 'TUTELARY_LOCAL_TREE_CACHE_SIZE', 0)
+    if not size:
+        return None
+    with _local_trees_lock:
+        if _local_trees is None or _local_trees.maxsize != size:
+            _local_trees = LRUCache(size)
+        return _local_trees
+
+
+def clear_local_tree_cache():
+    """Drop all permission trees held in the process-local cache."""
+    with _local_trees_lock:
+        if _local_trees is not None:
+            _local_trees.clear()
+
+
+def _role_policy_ids(roles):
+    """Ordered policy IDs for each of a list of roles, as a dictionary
+    keyed by role ID.  The policy IDs are cached on the role instances,
+    and the policies of any roles without cached policy IDs are
+    fetched in a single query.
+
+    """
+    missing = [r for r in roles if not hasattr(r, '_policy_ids')]
+    if missing:
+        policy_ids = {r.pk: [] for r in missing}
+        for role, policy in (RolePolicyAssign.objects
+                             .filter(role__in=missing)
+                             .order_by('role', 'index')
+                             .values_list('role', 'policy')):
+            policy_ids[role].append(policy)
+        for r in missing:
+            r._policy_ids = policy_ids[r.pk]
+    return {r.pk: r._policy_ids for r in roles}
+
+
+def pset_fingerprint(policy_instances):
+    """Fingerprint identifying a permission set by its ordered sequence of
+    policy instances, given as (policy ID, variable assignment JSON,
+    role ID or ``None``) tuples.
+
+    """
+    return hashlib.sha1(json.dumps([
+        (policy, json.dumps(json.loads(variables), sort_keys=True), role)
+        for policy, variables, role in policy_instances
+    ]).encode()).hexdigest()
+
+
 class PermissionSetManager(models.Manager):
     """Permission sets have a custom manager that folds all instances with
-    the same set of policy instances together in the database.
+    the same set of policy instances together in the database.  The
+    stored permission tree is only loaded when it's needed.
 
     """
 
+    def get_queryset(self):
+        return super().get_queryset().defer('stored_tree',
+                                            'stored_tree_fingerprint')
+
     def by_policies_and_roles(self, policies_roles):
         # Canonicalise input policy list to include empty variable
         # assignments where necessary, serialise variable assignments
         # to strings for policy instance lookup, and expand roles to
         # their corresponding lists of policies.
+        # Policies are represented by their IDs, and the policies for
+        # all roles are looked up together.
+        policies_roles = [pr if isinstance(pr, tuple) else (pr, None)
+                          for pr in policies_roles]
+        role_policies = _role_policy_ids(
+            [pr for pr, _ in policies_roles if isinstance(pr, Role)]
+        )
         canonpols = []
-        for pr in policies_roles:
-            vars = '{}'
-            if isinstance(pr, tuple):
-                vars = json.dumps(pr[1])
-                pr = pr[0]
+        for pr, vars in policies_roles:
+            vars = json.dumps(vars) if vars is not None else '{}'
             if isinstance(pr, Role):
                 vars = json.dumps(pr.variables)
-                policy_assignments = RolePolicyAssign.objects.filter(
-                    role=pr).select_related('policy')
-                for rp in policy_assignments:
-                    canonpols.append((rp.policy, vars, pr))
+                for policy in role_policies[pr.pk]:
+                    canonpols.append((policy, vars, pr.pk))
             else:
-                canonpols.append((pr, vars, None))
-
-        # Try to find an existing permission set using all the same
-        # policies and variable assignments.
-        policies = [policy for (policy, variables, role) in canonpols]
-        matching_psets = _policy_psets(policies).annotate(
-            num_pis=models.Count('policyinstance')
-        ).filter(
-            # Same number of policy instances
-            num_pis=len(canonpols)
-        )
-
-        for policy, variables, role in canonpols:
-            # Now, for each permission set candidate, check whether
-            # the policy instance rows correspond exactly to the input
-            # policy+variable assignment list.
-            matching_psets = matching_psets.filter(
-                policyinstance__policy=policy,
-                policyinstance__variables=variables,
-                policyinstance__role=role,
-            )
-        matched_pset = matching_psets.first()
-        if matched_pset:
-            return matched_pset
-
-        # If we get here, there is not an existing permission set for
-        # the exact combination of policies and variable assignments
-        # used here.  So we create one.
-
-        # The permission set model stores the JSON serialisation of
-        # this tree structure.
-
-        # Create a PermissionSet for use in building the relevant
-        # PolicyInstance objects.
-        obj = self.create()
-
-        # Set up policy instance references.
-        PolicyInstance.objects.bulk_create([
-            PolicyInstance(
-                pset=obj, policy=policy, role=role,
-                index=i, variables=variables
-            ) for i, (policy, variables, role) in enumerate(canonpols)
-        ])
+                canonpols.append((pr.pk, vars, None))
+
+        # Find an existing permission set using all the same policies
+        # and variable assignments in the same order, by their
+        # fingerprint, or create one, with its policy instances, if
+        # there isn't one.  The unique index on the fingerprint means
+        # that concurrent assignments of the same policies can't
+        # create duplicate permission sets.
+        fingerprint = pset_fingerprint(canonpols)
+        try:
+            return self.get(fingerprint=fingerprint)
+        except PermissionSet.DoesNotExist:
+            pass
+        with transaction.atomic():
+            obj, created = self.get_or_create(fingerprint=fingerprint)
+            if created:
+                PolicyInstance.objects.bulk_create([
+                    PolicyInstance(
+                        pset=obj, policy_id=policy, role_id=role,
+                        index=i, variables=variables
+                    ) for i, (policy, variables, role) in enumerate(canonpols)
+                ])
 
         # The construction of the permission tree for this permission
         # set happens lazily when needed, so at this point we just
-        # return the newly constructed object.
+        # return the permission set object.
         return obj
 
 
@@ -255,30 +503,150 @@ class PermissionSet(models.Model):
                                    related_name='permissionset')
     anonymous_user = models.BooleanField(default=False)
 
+    # Fingerprint of the sequence of policy instances, for finding
+    # existing permission sets (see pset_fingerprint).
+    fingerprint = models.CharField(max_length=40, unique=True, null=True,
+                                   editable=False)
+
+    # Binary encoding of the permission tree, used when
+    # TUTELARY_STORE_TREES is set, with a fingerprint giving the tree
+    # format version.  When any of the policies are changed, the tree
+    # is cleared and the fingerprint replaced by a unique token, which
+    # guards against storing trees built from the old policies.
+    stored_tree = models.BinaryField(null=True, editable=False)
+    stored_tree_fingerprint = models.CharField(max_length=64, blank=True,
+                                               editable=False)
+
     # Custom manager to deal with folding together permission sets
     # generated from identical sequences of policies.
     objects = PermissionSetManager()
 
-    def cache_key(self):
-        return 'tutelary:ptree:' + str(self.pk)
+    def cache_key(self, generation=None):
+        """Cache key for the permission set's tree, for the given (or
+        current) tree generation.
+
+        """
+        if generation is None:
+            generation = tree_generation()
+        return 'tutelary:ptree:{}:{}:{}'.format(
+            TREE_CACHE_VERSION,
+            generation[0] if generation is not None else '-', self.pk
+        )
 
     def tree(self):
-        key = self.cache_key()
-        cached = cache.get(key)
+        """Permission tree for the permission set.  Trees are shared
+        between processes through the Django cache and, if
+        ``TUTELARY_LOCAL_TREE_CACHE_SIZE`` is set, also kept in a
+        process-local LRU cache, whose entries are only used while the
+        shared tree generation counter is unchanged.
+
+        Missing trees are rebuilt by one process at a time, holding a
+        lock in the cache for at most ``TUTELARY_TREE_LOCK_TIMEOUT``
+        seconds.  Meanwhile, other processes use the permission set's
+        previous tree if they have it cached locally and it was only
+        invalidated by policy changes, or otherwise wait for up to
+        ``TUTELARY_TREE_LOCK_WAIT`` seconds for the new tree before
+        building it themselves.
+
+        """
+        local = local_tree_cache()
+        generation = tree_generation()
+        stale = None
+        if local is not None and generation is not None:
+            with _local_trees_lock:
+                hit = local.get(self.pk)
+            if hit is not None:
+                if hit[0] == generation:
+                    return hit[1]
+                if hit[0][1] == generation[1]:
+                    stale = hit[1]
+        key = self.cache_key(generation)
+        cached, size = _cache_get_tree(key)
         if cached is None:
-            ptree = engine.PermissionTree(
-                policies=[engine.PolicyBody(json=pi.policy.body,
-                                            variables=json.loads(pi.variables))
-                          for pi in (PolicyInstance.objects
-                                     .select_related('policy')
-                                     .filter(pset=self))]
-            )
-            cache.set(key, ptree)
-            cached = ptree
+            lock_key = key + ':lock'
+            timeout = getattr(settings, 'TUTELARY_TREE_LOCK_TIMEOUT', 30)
+            token = uuid.uuid4().hex
+            if cache.add(lock_key, token, timeout):
+                try:
+                    cached, size = self._build_tree(key)
+                finally:
+                    # The lock may have expired and been taken by
+                    # another process while building.
+                    if cache.get(lock_key) == token:
+                        cache.delete(lock_key)
+            elif stale is not None:
+                return stale
+            else:
+                cached, size = self._wait_for_tree(key, lock_key)
+        if local is not None and generation is not None:
+            with _local_trees_lock:
+                local.put(self.pk, (generation, cached), size)
         return cached
 
+    def _build_tree(self, key):
+        # Build the permission tree from the permission set's policy
+        # instances, or load it from the database if it's stored there,
+        # and store it in the cache.
+        memo_size = getattr(settings, 'TUTELARY_MEMO_SIZE', 0)
+        store = getattr(settings, 'TUTELARY_STORE_TREES', False)
+        if store:
+            # The fingerprint read here (before the policy instances)
+            # guards the write below against concurrent clearing.
+            stored = (PermissionSet.objects.filter(pk=self.pk)
+                      .values_list('stored_tree', 'stored_tree_fingerprint')
+                      .first())
+            if (stored is not None and stored[0] is not None and
+                    stored[1] == stored_tree_version()):
+                try:
+                    ptree = engine.PermissionTree.from_bytes(
+                        bytes(stored[0]), memo_size=memo_size
+                    )
+                    return ptree, cache_set_tree(key, ptree)
+                except ValueError:
+                    pass
+        pis = list(PolicyInstance.objects
+                   .select_related('policy')
+                   .filter(pset=self))
+        ptree = engine.PermissionTree.from_policies(
+            [policy_body(pi.policy.body, pi.variables) for pi in pis]
+        ).compile()
+        ptree.set_memo_size(memo_size)
+        size = cache_set_tree(key, ptree)
+        if store and stored is not None:
+            PermissionSet.objects.filter(
+                pk=self.pk, stored_tree_fingerprint=stored[1]
+            ).update(
+                stored_tree=ptree.to_bytes(),
+                stored_tree_fingerprint=stored_tree_version()
+            )
+        return ptree, size
+
+    def _wait_for_tree(self, key, lock_key):
+        # Wait for another process to finish building the permission
+        # tree, building it here if it takes too long or the other
+        # process gives up.
+        deadline = time.monotonic() + getattr(
+            settings, 'TUTELARY_TREE_LOCK_WAIT', 5
+        )
+        while time.monotonic() < deadline:
+            time.sleep(TREE_LOCK_POLL_INTERVAL)
+            cached, size = _cache_get_tree(key)
+            if cached is not None:
+                return cached, size
+            if cache.get(lock_key) is None:
+                break
+        return self._build_tree(key)
+
     def refresh(self):
-        cache.set(self.cache_key(), None)
+        """Invalidate the permission set's tree.  A permission set's
+        policy instances never change, so this is only needed when
+        the permission set is deleted (since its primary key may be
+        reused) or if policies are changed behind Tutelary's back.
+
+        """
+        cache.delete(self.cache_key())
+        bump_tree_generation(PSET_GENERATION_KEY)
+        clear_stored_trees(PermissionSet.objects.filter(pk=self.pk))
 
     def __str__(self):
         return str(self.pk)
@@ -339,6 +707,13 @@ def clear_user_policies(user):
     ``user`` is ``None``).
 
     """
+    _clear_user_pset(user)
+    cache.delete(user_cache_key(user))
+
+
+def _clear_user_pset(user):
+    # Detach a user from their permission set, deleting the permission
+    # set if it's no longer used.
     if user is None:
         try:
             pset = PermissionSet.objects.get(anonymous_user=True)
@@ -349,10 +724,10 @@ def clear_user_policies(user):
     else:
         pset = user.permissionset.first()
     if pset:
-        pset.refresh()
         if user is not None:
             pset.users.remove(user)
         if pset.users.count() == 0 and not pset.anonymous_user:
+            pset.refresh()
             pset.delete()
 
 
@@ -366,15 +741,14 @@ def assign_user_policies(user, *policies_roles):
     method on ``User`` model.
 
     """
-    clear_user_policies(user)
+    _clear_user_pset(user)
     pset = PermissionSet.objects.by_policies_and_roles(policies_roles)
-    pset.refresh()
     if user is None:
         pset.anonymous_user = True
     else:
         pset.users.add(user)
     pset.save()
-    cache.set(user_cache_key(user), None)
+    cache.delete(user_cache_key(user))
 
 
 def user_assigned_policies(user):
@@ -432,3 +806,251 @@ def check_perms(user, actions, objs, method=None):
                 if not user.has_perm(a, test_obj):
                     return False
     return True
+
+
+def check_perms_many(user, actions, objs):
+    """Batched version of ``check_perms`` for filtering lists of objects:
+    returns a list of booleans saying, for each object, whether the
+    user is permitted to perform all of the actions on it.  The
+    actions may also be given as a function mapping objects to
+    sequences of actions.  All the permission tests are made in a
+    single batch.  As for ``check_perms``, actions given as ``False``
+    are never permitted.
+
+    """
+    ensure_permission_set_tree_cached(user)
+    objs = list(objs)
+    pairs = []
+    owners = []
+    res = [True] * len(objs)
+    for i, o in enumerate(objs):
+        acts = actions(o) if callable(actions) else actions
+        if acts is False:
+            res[i] = False
+            continue
+        for a in acts:
+            pairs.append((a, o.get_permissions_object(a)
+                          if o is not None else None))
+            owners.append(i)
+    for i, ok in zip(owners, user_has_perms(user, pairs)):
+        if not ok:
+            res[i] = False
+    return res
+
+
+def perms_filter_pks(user, actions, objs, chunk_size=None):
+    """Streaming version of ``check_perms_many`` for querysets: generates
+    the primary keys of the objects in a queryset on which the user
+    is permitted to perform all of the actions.  Objects are read
+    from the database and tested in chunks of ``chunk_size`` (by
+    default, the ``TUTELARY_FILTER_CHUNK_SIZE`` setting), so memory
+    use doesn't depend on the size of the queryset.  Where the
+    permissions objects are made from the model's path fields, only
+    those fields are read.
+
+    """
+    from tutelary.decorators import get_perms_lookups, select_perms_related
+    if actions is False:
+        return
+    if chunk_size is None:
+        chunk_size = getattr(settings, 'TUTELARY_FILTER_CHUNK_SIZE', 2000)
+    lookups = None
+    if not callable(actions):
+        lookups = [get_perms_lookups(objs.model, a) for a in actions]
+        if any(lu is False for lu in lookups):
+            lookups = None
+    if lookups is None:
+        objs = select_perms_related(objs,
+                                    None if callable(actions) else actions)
+        for chunk in _chunks(_iterator(objs, chunk_size), chunk_size):
+            oks = check_perms_many(user, actions, chunk)
+            yield from (o.pk for o, ok in zip(chunk, oks) if ok)
+        return
+
+    ensure_permission_set_tree_cached(user)
+    fields = []
+    for lu in lookups:
+        for lookup, _ in lu[1] if lu is not None else ():
+            if lookup not in fields:
+                fields.append(lookup)
+    rows = _iterator(objs.values_list('pk', *fields), chunk_size)
+    for chunk in _chunks(rows, chunk_size):
+        pairs = []
+        for row in chunk:
+            values = dict(zip(fields, row[1:]))
+            for action, lu in zip(actions, lookups):
+                obj = None
+                if lu is not None:
+                    it = (str(values[lookup]) for lookup, _ in lu[1])
+                    obj = engine.Object.from_components(tuple(
+                        next(it) if c is None else c for c in lu[0]
+                    ))
+                pairs.append((action, obj))
+        oks = iter(user_has_perms(user, pairs))
+        for row in chunk:
+            if all([next(oks) for _ in actions]):
+                yield row[0]
+
+
+def _iterator(queryset, chunk_size):
+    # Iterate over a queryset without caching its results.
+    if django.VERSION >= (2, 0):
+        return queryset.iterator(chunk_size=chunk_size)
+    return queryset.iterator()
+
+
+def _chunks(it, size):
+    it = iter(it)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+def perms_q(user, actions, model):
+    """Translate permission tests for all the instances of a permissioned
+    model into a ``Q`` object selecting the instances on which a user
+    is permitted to perform all of a sequence of actions, so that
+    querysets can be filtered in the database.  Returns ``None`` if
+    the tests can't be translated: if the model's permissions objects
+    aren't made from its path fields, or if there are authentication
+    backends other than Tutelary's that could grant permissions on
+    objects.
+
+    """
+    from tutelary.decorators import get_perms_lookups
+    if actions is False:
+        return models.Q(pk__in=[])
+    for backend in get_backends():
+        if isinstance(backend, Backend):
+            if (type(backend).has_perm is not Backend.has_perm or
+                    type(backend).has_perms_many is not
+                    Backend.has_perms_many):
+                return None
+        elif not (isinstance(backend, ModelBackend) and
+                  type(backend).has_perm is ModelBackend.has_perm):
+            return None
+    lookups = [get_perms_lookups(model, a) for a in actions]
+    if any(lu is False for lu in lookups):
+        return None
+    if user.is_active and getattr(user, 'is_superuser', False):
+        return models.Q()
+
+    res = True
+    for action, lu in zip(actions, lookups):
+        if lu is None:
+            ok = user_has_perms(user, [(action, None)])[0]
+        else:
+            try:
+                ptree = user.permset_tree
+            except ObjectDoesNotExist:
+                ok = False
+            else:
+                ok = _alternatives_q(
+                    ptree.alternatives(engine.Action.get(action), lu[0]),
+                    _pattern_lookups(lu)
+                )
+        res = _q_and(res, ok)
+    if res is True:
+        return models.Q()
+    if res is False:
+        return models.Q(pk__in=[])
+    return res
+
+
+def _pattern_lookups(lookups):
+    # Map object path positions to (lookup, field) pairs.
+    pattern, fields = lookups
+    it = iter(fields)
+    return [next(it) if c is None else None for c in pattern]
+
+
+def _alternatives_q(alternatives, lookups):
+    # Fold an ordered list of permission tree alternatives into a
+    # condition that's True, False or a Q object: an allow effect
+    # takes effect if its conditions hold, and a deny effect if its
+    # conditions hold and those of no earlier alternative do.
+    res = False
+    for conds, effect in reversed(alternatives):
+        cond = True
+        for i, keys in conds:
+            cond = _q_and(cond, _lookup_q(*lookups[i], keys=keys))
+        if effect == 'allow':
+            res = _q_or(cond, res)
+        else:
+            res = _q_and(_q_not(cond), res)
+    return res
+
+
+def _lookup_q(lookup, field, keys):
+    # Condition for a field's string value being one of a list of keys.
+    # Keys that aren't the string value of any field value (e.g.
+    # non-numeric keys for integer fields) can't match.
+    values = []
+    for k in keys:
+        try:
+            v = field.to_python(k)
+        except (ValidationError, ValueError, TypeError):
+            continue
+        if str(v) == k:
+            values.append(v)
+    if len(values) == 0:
+        return False
+    if len(values) == 1:
+        return models.Q(**{lookup: values[0]})
+    return models.Q(**{lookup + '__in': values})
+
+
+def _q_and(p, q):
+    if p is False or q is False:
+        return False
+    if p is True:
+        return q
+    if q is True:
+        return p
+    return p & q
+
+
+def _q_or(p, q):
+    if p is True or q is True:
+        return True
+    if p is False:
+        return q
+    if q is False:
+        return p
+    return p | q
+
+
+def _q_not(p):
+    if p is True or p is False:
+        return not p
+    return ~p
+
+
+def user_has_perms(user, pairs):
+    """Batched equivalent of calling ``user.has_perm`` for each of a
+    sequence of (action, object) pairs.  Authentication backends that
+    provide a ``has_perms_many`` method test all the pairs at once.
+
+    """
+    if user.is_active and getattr(user, 'is_superuser', False):
+        return [True] * len(pairs)
+    res = [None] * len(pairs)
+    for backend in get_backends():
+        todo = [i for i, r in enumerate(res) if r is None]
+        if len(todo) == 0:
+            break
+        if hasattr(backend, 'has_perms_many'):
+            oks = backend.has_perms_many(user, [pairs[i] for i in todo])
+            for i, ok in zip(todo, oks):
+                if ok:
+                    res[i] = True
+        elif hasattr(backend, 'has_perm'):
+            for i in todo:
+                try:
+                    if backend.has_perm(user, *pairs[i]):
+                        res[i] = True
+                except PermissionDenied:
+                    res[i] = False
+    return [r is True for r in res]
@@ -1,6 +1,10 @@
 # coding:utf-8
+import struct
+import sys
+from array import array
 from collections import MutableMapping
-from json import loads, dumps
+from itertools import repeat
+from json import loads, dumps, JSONDecodeError
 from pprint import pformat
 
 
@@ -20,15 +24,45 @@ class WildTree(MutableMapping):
         By default, all new ``WildTree`` objects are empty.  They can also
         be deserialised from a JSON representation.  We store the
         optional value at the endpoint of the path to this node, plus
-        a list of subtrees.  Each subtree is a pair whose first
-        element is a key value (which may be a ``*`` wildcard) and
-        whose second element is a ``WildTree``.
+        the subtrees below the node.  Subtrees for exact key values
+        are held in a dictionary indexed by key value, and the subtree
+        for the ``*`` wildcard is held separately.  Exact subtrees
+        that were inserted before the wildcard subtree are overridden
+        by it, so are kept in a list of "shadowed" dictionaries that
+        are only consulted after the wildcard (see ``new_node``).
+
+        Subtrees can be shared between several parents (see
+        ``set_product``).  Shared nodes are recorded in ``shared``
+        (indexed by ``id``) and are copied before being modified.
 
         """
+        self.shared = {}
         if json is None:
-            self.root = {'item': None, 'subtrees': []}
+            self.root = new_node()
         else:
             self.root = loads(json)
+            if 'subtrees' in self.root:
+                self.root = from_list_node(self.root)
+
+    def __getstate__(self):
+        return self.root
+
+    def __setstate__(self, state):
+        self.root = state
+        self._find_shared()
+
+    def to_bytes(self):
+        """
+        Compact binary serialisation, via ``CompiledWildTree``.
+        """
+        return CompiledWildTree(self).to_bytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Deserialisation from the binary representation.
+        """
+        return CompiledWildTree.from_bytes(data).to_wildtree()
 
     def __repr__(self):
         return pformat(self.root)
@@ -44,15 +78,9 @@ class WildTree(MutableMapping):
         Exact path membership: wildcards must be matched explicitly.
         """
         node = self.root
-        while len(key) > 0:
-            head, key = key[0], key[1:]
-            found = False
-            for st in node['subtrees']:
-                if st[0] == head:
-                    found = True
-                    node = st[1]
-                    break
-            if not found:
+        for head in key:
+            node = exact_child(node, head, shadowed=True)
+            if node is None:
                 return False
         return node['item'] is not None
 
@@ -65,7 +93,7 @@ class WildTree(MutableMapping):
 
         """
         def _len_help(tree):
-            n = sum(_len_help(t[1]) for t in tree['subtrees'])
+            n = sum(_len_help(st) for _, _, st in children(tree))
             return n + 1 if tree['item'] is not None else n
         return _len_help(self.root)
 
@@ -76,16 +104,28 @@ class WildTree(MutableMapping):
         def _iter_help(tree):
             if tree['item'] is not None:
                 yield ()
-            for st in tree['subtrees']:
-                for tail in _iter_help(st[1]):
-                    yield (st[0],) + tail
+            for _, k, st in children(tree):
+                for tail in _iter_help(st):
+                    yield (k,) + tail
         yield from _iter_help(self.root)
 
     def __getitem__(self, key):
         """
         Key lookup with wildcards.
         """
-        return find_in_tree(self.root, key)[0]
+        item = search(self.root, key)
+        if item is None:
+            raise KeyError(key)
+        return item
+
+    def get(self, key, default=None):
+        """
+        Key lookup with wildcards, returning a default value rather than
+        throwing ``KeyError`` if the key path doesn't exist.
+
+        """
+        item = search(self.root, key)
+        return default if item is None else item
 
     def __setitem__(self, key, value):
         """
@@ -94,34 +134,64 @@ class WildTree(MutableMapping):
 
         """
         self._purge_unreachable(key)
-        node = self.root
-        while len(key) > 0:
-            found = False
-            for st in node['subtrees']:
-                if st[0] == key[0]:
-                    found = True
-                    node = st[1]
-                    break
-                elif st[0] == '*':
-                    break
-            if not found:
-                default = {'item': None, 'subtrees': []}
-                node['subtrees'].insert(0, (key[0], default))
-                node = default
-            key = key[1:]
-        node['item'] = value
+        self._path(key)['item'] = value
 
     def __delitem__(self, key):
         """
         Key deletion: wildcards must be matched explicitly.
         """
         _, idxs = find_in_tree(self.root, key, perfect=True)
-        del_by_idx(self.root, idxs)
+        del_by_idx(self.root, idxs, self.shared)
+
+    def set_product(self, prefixes, suffixes, value):
+        """
+        Insert all key paths made by joining one of a sequence of
+        prefixes to one of a sequence of suffixes, with the same result
+        as inserting ``prefix + suffix`` for each prefix and suffix in
+        turn.
+
+        Where there are no existing key paths below a prefix that the
+        new key paths could override, the subtree for the suffixes is
+        built once and shared between all such prefixes, so that the
+        time and space needed don't grow with the number of prefixes.
+
+        """
+        suffixes = [tuple(s) for s in suffixes]
+        sub = None
+        for prefix in prefixes:
+            prefix = tuple(prefix)
+            if sub is None and len(prefix) > 0:
+                sub = product_subtree(suffixes, value)
+            if not sub or self._dominated_prefix(prefix):
+                for suffix in suffixes:
+                    self[prefix + suffix] = value
+                continue
+            node = self._path(prefix)
+            node['item'] = sub['item']
+            node['exact'] = dict(sub['exact'])
+            node['wild'] = sub['wild']
+            node['shadowed'] = [dict(tier) for tier in sub['shadowed']]
+            for _, _, st in children(node):
+                self.shared[id(st)] = st
+
+    def alternatives(self, key):
+        """
+        Ordered ``(conditions, value)`` alternatives for looking up a key
+        path some of whose components are free, given as ``None``.
+        Each condition is a ``(position, keys)`` pair, requiring the
+        component at that position to be one of the keys.  Looking up
+        a key path filling in the free components gives the value of
+        the first alternative whose conditions it satisfies, or
+        nothing if it satisfies none of them.  Values must be
+        hashable.
+
+        """
+        return alternatives(self.root, tuple(key))
 
     def find(self, key, perfect=False):
         """
         Find a key path in the tree, matching wildcards.  Return value for
-        key, along with index path through subtree lists to the result.  Throw
+        key, along with index path through subtrees to the result.  Throw
         ``KeyError`` if the key path doesn't exist in the tree.
 
         """
@@ -133,55 +203,873 @@ class WildTree(MutableMapping):
         path.
 
         """
-        dels = []
-        for p in self:
-            if dominates(key, p):
-                dels.append(p)
-        for k in dels:
+        for k in list(dominated_keys(self.root, key)):
             _, idxs = find_in_tree(self.root, k, perfect=True)
-            del_by_idx(self.root, idxs)
+            del_by_idx(self.root, idxs, self.shared)
+
+    def _path(self, key):
+        """
+        Find the node for a key path, creating nodes as needed and copying
+        any shared nodes on the way, ready for modification.
+
+        """
+        node = self.root
+        for head in key:
+            if head == '*':
+                if node['wild'] is None:
+                    # A new wildcard subtree overrides all existing
+                    # exact subtrees at this level.
+                    node['shadowed'] = merge_tiers([node['exact']] +
+                                                   node['shadowed'])
+                    node['exact'] = {}
+                    node['wild'] = new_node()
+                child = node['wild']
+            else:
+                # Exact subtrees shadowed by a wildcard can't be
+                # reused, since the new key must take precedence over
+                # the wildcard.
+                child = exact_child(node, head,
+                                    shadowed=node['wild'] is None)
+                if child is None:
+                    child = new_node()
+                    node['exact'][head] = child
+            if id(child) in self.shared:
+                child = replace_child(node, head, child,
+                                      copy_node(child, self.shared))
+            node = child
+        return node
+
+    def _dominated_prefix(self, prefix):
+        """
+        Determine whether there are any key paths in the tree whose first
+        components are dominated by a prefix.
+
+        """
+        stack = [(self.root, 0)]
+        while stack:
+            node, i = stack.pop()
+            if i == len(prefix):
+                return True
+            if prefix[i] == '*':
+                stack.extend((st, i + 1) for _, _, st in children(node))
+            else:
+                stack.extend((st, i + 1) for _, st in
+                             candidates(node, prefix[i], perfect=True))
+        return False
+
+    def _find_shared(self):
+        """
+        Record the nodes that have more than one parent.
+        """
+        self.shared = {}
+        seen = set()
+        stack = [self.root]
+        while stack:
+            for _, _, st in children(stack.pop()):
+                if id(st) in seen:
+                    self.shared[id(st)] = st
+                else:
+                    seen.add(id(st))
+                    stack.append(st)
+
+
+class CompiledWildTree:
+    """
+    Immutable, array-backed form of a ``WildTree``, used for fast
+    repeated lookups.  Each tree node becomes an integer state, with
+    state 0 being the root.  For each state we record:
+
+     - ``items``: the value stored at the state, or ``None``;
+     - ``final``: the value found if the key path ends at the state,
+       i.e. the value stored there or at the end of a chain of
+       wildcard transitions;
+     - ``trans``: a transition table mapping each key component to
+       the tuple of states to try for it, in backtracking order;
+     - ``fallback``: the states to try for any key component not in
+       the transition table (the wildcard state, if there is one).
+
+    Lookups with ``get`` return the same results as ``WildTree``
+    lookups.  Compiled trees can be converted back to ``WildTree``
+    with ``to_wildtree``.
+
+    Compiled trees have a compact binary encoding (see ``to_bytes``),
+    which is also used for pickling.  Values stored in the tree must
+    then be hashable and JSON-serialisable.
+
+    """
+    __slots__ = ('items', 'final', 'trans', 'fallback')
+
+    def __init__(self, tree):
+        """
+        Compile a ``WildTree`` (or its root node).
+        """
+        root = tree.root if isinstance(tree, WildTree) else tree
+        nodes = [root]
+        ids = {id(root): 0}
+        for node in nodes:
+            for _, _, st in children(node):
+                if id(st) not in ids:
+                    ids[id(st)] = len(nodes)
+                    nodes.append(st)
+        items, trans, fallback = [], [], []
+        for node in nodes:
+            items.append(node['item'])
+            wild = ()
+            if node['wild'] is not None:
+                wild = (ids[id(node['wild'])],)
+            ts = {k: (ids[id(st)],) + wild
+                  for k, st in node['exact'].items()}
+            for tier in node['shadowed']:
+                for k, st in tier.items():
+                    ts[k] = ts.get(k, wild) + (ids[id(st)],)
+            if wild:
+                ts['*'] = wild
+            trans.append(ts)
+            fallback.append(wild)
+        final = []
+        for s in range(len(nodes)):
+            t = s
+            while items[t] is None and fallback[t]:
+                t = fallback[t][0]
+            final.append(items[t])
+        self.items = tuple(items)
+        self.final = tuple(final)
+        self.trans = tuple(trans)
+        self.fallback = tuple(fallback)
+
+    def __getstate__(self):
+        return self.to_bytes()
+
+    def __setstate__(self, state):
+        self._decode(state)
+
+    def to_bytes(self):
+        """
+        Compact binary encoding.  After a header giving the format version
+        comes a JSON table of the distinct values in the tree and of
+        the key components for all transitions, in order, followed by
+        a sequence of integer arrays, each stored with the smallest
+        item size that will do:
+
+         - the value index for each state (zero for ``None``);
+         - the states that have transitions, and for each of them the
+           number of transitions, the wildcard state plus one (zero
+           for none) and the kind of transitions;
+         - for each transition of the kind with more than one target
+           state, the number of target states stored, shifted left by
+           one, with the low bit set if there's an exact subtree;
+         - the target states.  Wildcard states are not stored again,
+           since they always come in the same place, and a run of
+           consecutive single target states is stored as its first
+           state.
+
+        End-of-key values are recomputed on decoding.
+
+        """
+        values = {None: 0}
+        for item in self.items:
+            if item not in values:
+                values[item] = len(values)
+        states, ntrans, wilds, kinds = [], [], [], []
+        comps, flags, stored = [], [], []
+        for s in range(len(self.items)):
+            ts = self.trans[s]
+            if not ts:
+                continue
+            wild = self.fallback[s]
+            states.append(s)
+            wilds.append(wild[0] + 1 if wild else 0)
+            targets = []
+            for k, st in ts.items():
+                if k == '*':
+                    continue
+                comps.append(k)
+                if not wild:
+                    targets.append((1, st))
+                elif st[0] == wild[0]:
+                    targets.append((0, st[1:]))
+                else:
+                    targets.append((1, st[:1] + st[2:]))
+            ntrans.append(len(targets))
+            if any(exact != 1 or len(st) != 1 for exact, st in targets):
+                kinds.append(TRANS_GENERAL)
+                for exact, st in targets:
+                    flags.append(len(st) << 1 | exact)
+                    stored.extend(st)
+            elif len(targets) > 1 and all(
+                    st[0] == targets[0][1][0] + i
+                    for i, (_, st) in enumerate(targets)):
+                kinds.append(TRANS_RUN)
+                stored.extend(targets[0][1][:1])
+            else:
+                kinds.append(TRANS_SINGLE)
+                stored.extend(st[0] for _, st in targets)
+        table = dumps([list(values)[1:], comps],
+                      separators=(',', ':')).encode()
+        arrays = [[values[item] for item in self.items],
+                  states, ntrans, wilds, kinds, flags, stored]
+        return b''.join([HEADER.pack(MAGIC, FORMAT_VERSION, len(table)),
+                         table] + [pack_array(a) for a in arrays])
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Decode the binary encoding produced by ``to_bytes``.  Throws
+        ``ValueError`` for data that isn't in a supported format.
+
+        """
+        tree = cls.__new__(cls)
+        tree._decode(data)
+        return tree
+
+    def _decode(self, data):
+        try:
+            magic, version, ntable = HEADER.unpack_from(data)
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise ValueError('unsupported compiled tree format')
+            pos = HEADER.size + ntable
+            values, comps = loads(data[HEADER.size:pos].decode())
+            arrays = []
+            for _ in range(7):
+                a, pos = unpack_array(data, pos)
+                arrays.append(a)
+            items, states, ntrans, wilds, kinds, flags, stored = arrays
+            # Check all state references, since transitions are only
+            # decoded when they are first used.
+            nstates = len(items)
+            if (not len(states) == len(ntrans) == len(wilds) == len(kinds) or
+                    max(states, default=-1) >= nstates or
+                    max(wilds, default=0) > nstates or
+                    max(kinds, default=0) > TRANS_GENERAL or
+                    max(stored, default=-1) >= nstates):
+                raise ValueError('invalid compiled tree data')
+            values = [None] + values
+            self.items = tuple(map(values.__getitem__, items))
+            fallback = [()] * nstates
+            for s, w in zip(states, wilds):
+                if w:
+                    # Wildcard states always come after their parents,
+                    # so following them can't loop.
+                    if w - 1 <= s:
+                        raise ValueError('invalid compiled tree data')
+                    fallback[s] = (w - 1,)
+            self.fallback = tuple(fallback)
+            final = list(self.items)
+            for s in states:
+                t = s
+                while final[t] is None and fallback[t]:
+                    t = fallback[t][0]
+                final[s] = final[t]
+            self.final = tuple(final)
+            self.trans = TransitionTable(comps, self.fallback, states,
+                                         ntrans, kinds, flags, stored)
+        except (struct.error, UnicodeDecodeError, JSONDecodeError,
+                IndexError, TypeError, KeyError):
+            raise ValueError('invalid compiled tree data')
+
+    def __len__(self):
+        return sum(1 for item in self.items if item is not None)
+
+    def get(self, key, default=None):
+        """
+        Key lookup with wildcards, returning a default value if the key
+        path doesn't exist.
+
+        """
+        final, trans, fallback = self.final, self.trans, self.fallback
+        n = len(key)
+        stack = []
+        s, i = 0, 0
+        while True:
+            if i == n:
+                item = final[s]
+                if item is not None:
+                    return item
+            else:
+                states = trans[s].get(key[i], fallback[s])
+                i += 1
+                if states:
+                    s = states[0]
+                    if len(states) > 1:
+                        for t in reversed(states[1:]):
+                            stack.append((t, i))
+                    continue
+            if not stack:
+                return default
+            s, i = stack.pop()
+
+    def get_many(self, keys, default=None):
+        """
+        Look up a sequence of keys at once, returning a list of values
+        (or the default value for keys that don't exist).  The keys
+        are merged into a trie so that lookups for keys with a common
+        prefix share the work of matching the prefix.  The result for
+        each key is the same as for ``get``.
+
+        """
+        results = [default] * len(keys)
+        # Group keys by all but their last component, so that a query
+        # trie only needs to be built for the distinct prefixes.
+        # Query trie nodes are [indexes of keys ending here, subtries,
+        # number of unresolved keys in this subtrie, indexes of keys
+        # ending one level below, grouped by last component].
+        queries = [[], {}, 0, {}]
+        groups = {}
+        for idx, key in enumerate(keys):
+            if len(key) == 0:
+                queries[0].append(idx)
+                queries[2] += 1
+                continue
+            prefix = tuple(key[:-1])
+            group = groups.get(prefix)
+            if group is None:
+                group = groups[prefix] = {}
+            idxs = group.get(key[-1])
+            if idxs is None:
+                group[key[-1]] = [idx]
+            else:
+                idxs.append(idx)
+        for prefix, group in groups.items():
+            n = sum(len(idxs) for idxs in group.values())
+            q = queries
+            q[2] += n
+            for head in prefix:
+                sub = q[1].get(head)
+                if sub is None:
+                    sub = q[1][head] = [[], {}, 0, {}]
+                q = sub
+                q[2] += n
+            q[3] = group
+        final, trans, fallback = self.final, self.trans, self.fallback
+
+        def resolve(s, q):
+            # Visit the trie node q in state s, trying alternatives in
+            # backtracking order and skipping any subtries whose keys
+            # have all been resolved.  Returns the number of keys
+            # resolved.
+            done = 0
+            if q[0]:
+                item = final[s]
+                if item is not None:
+                    for idx in q[0]:
+                        results[idx] = item
+                    done = len(q[0])
+                    q[0] = []
+            group = q[3]
+            if group:
+                ts, fb = trans[s], fallback[s]
+                resolved = []
+                for head, idxs in group.items():
+                    for t in ts.get(head, fb):
+                        item = final[t]
+                        if item is not None:
+                            for idx in idxs:
+                                results[idx] = item
+                            done += len(idxs)
+                            resolved.append(head)
+                            break
+                for head in resolved:
+                    del group[head]
+            for head, sub in q[1].items():
+                if sub[2] > 0:
+                    for t in trans[s].get(head, fallback[s]):
+                        n = resolve(t, sub)
+                        sub[2] -= n
+                        done += n
+                        if sub[2] == 0:
+                            break
+            return done
+
+        resolve(0, queries)
+        return results
+
+    def to_wildtree(self):
+        """
+        Convert back to a mutable ``WildTree``.
+        """
+        nodes = [new_node(item) for item in self.items]
+        for s, node in enumerate(nodes):
+            wild = self.fallback[s]
+            if wild:
+                node['wild'] = nodes[wild[0]]
+            for k, states in self.trans[s].items():
+                if k == '*':
+                    continue
+                if wild:
+                    split = states.index(wild[0])
+                    exact, states = states[:split], states[split + 1:]
+                else:
+                    exact, states = states[:1], states[1:]
+                if exact:
+                    node['exact'][k] = nodes[exact[0]]
+                for d, t in enumerate(states):
+                    if d == len(node['shadowed']):
+                        node['shadowed'].append({})
+                    node['shadowed'][d][k] = nodes[t]
+        tree = WildTree()
+        tree.root = nodes[0]
+        tree._find_shared()
+        return tree
+
+
+# Binary encoding of compiled trees: magic number, format version and
+# length of the string table.
+MAGIC = b'TWT'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<3sBI')
+ARRAY_HEADER = struct.Struct('<cI')
+ARRAY_TYPES = [t for t in 'BHIL' if array(t).itemsize in (1, 2, 4)]
+
+
+def pack_array(values):
+    """
+    Encode a list of unsigned integers as an array of the smallest item
+    size that will hold them, with a header giving the array type and
+    length.  Arrays are stored in little-endian byte order.
+
+    """
+    top = max(values, default=0)
+    for t in ARRAY_TYPES:
+        if top < 1 << 8 * array(t).itemsize:
+            break
+    a = array(t, values)
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return ARRAY_HEADER.pack(t.encode(), len(a)) + a.tobytes()
+
+
+def unpack_array(data, pos):
+    """
+    Decode an array encoded by ``pack_array`` starting at offset ``pos``
+    in ``data``, returning the array and the offset following it.
+
+    """
+    t, n = ARRAY_HEADER.unpack_from(data, pos)
+    t = t.decode()
+    if t not in ARRAY_TYPES:
+        raise ValueError('invalid compiled tree data')
+    pos += ARRAY_HEADER.size
+    a = array(t)
+    a.frombytes(data[pos:pos + n * a.itemsize])
+    if len(a) != n:
+        raise ValueError('truncated compiled tree data')
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return a, pos + n * a.itemsize
+
 
+# Kinds of transitions for a state in the binary encoding: one exact
+# target state per transition, the same but with the target states
+# forming a run of consecutive states, or anything else.
+TRANS_SINGLE = 0
+TRANS_RUN = 1
+TRANS_GENERAL = 2
 
-def del_by_idx(tree, idxs):
+
+class TransitionTable(dict):
+    """
+    Transition tables for the states of a decoded ``CompiledWildTree``,
+    indexed by state.  The table for each state is only built from the
+    encoded arrays when it is first used, so that loading a large
+    tree doesn't cost more than the lookups made in it.
+
+    """
+    def __init__(self, comps, fallback, states, ntrans, kinds, flags,
+                 stored):
+        self.comps = comps
+        self.fallback = fallback
+        self.flags = flags
+        self.stored = stored
+        # Offsets of each state's transitions in the component list,
+        # flags and stored target states.
+        self.index = {}
+        c = f = t = 0
+        for s, n, kind in zip(states, ntrans, kinds):
+            self.index[s] = (n, kind, c, f, t)
+            c += n
+            if kind == TRANS_GENERAL:
+                t += sum(flag >> 1 for flag in flags[f:f + n])
+                f += n
+            elif kind == TRANS_RUN:
+                if stored[t] + n > len(fallback):
+                    raise ValueError('invalid compiled tree data')
+                t += 1
+            else:
+                t += n
+        if c > len(comps) or f > len(flags) or t > len(stored):
+            raise ValueError('invalid compiled tree data')
+
+    def __missing__(self, s):
+        if s not in self.index:
+            return {}
+        n, kind, c, f, t = self.index[s]
+        comps = self.comps[c:c + n]
+        wild = self.fallback[s]
+        if kind == TRANS_GENERAL:
+            ts = {}
+            for k, flag in zip(comps, self.flags[f:f + n]):
+                states = tuple(self.stored[t:t + (flag >> 1)])
+                t += flag >> 1
+                if wild:
+                    states = (states[:1] + wild + states[1:] if flag & 1
+                              else wild + states)
+                ts[k] = states
+        else:
+            if kind == TRANS_RUN:
+                targets = range(self.stored[t], self.stored[t] + n)
+            else:
+                targets = self.stored[t:t + n]
+            if wild:
+                ts = dict(zip(comps, zip(targets, repeat(wild[0]))))
+            else:
+                ts = dict(zip(comps, zip(targets)))
+        if wild:
+            ts['*'] = wild
+        self[s] = ts
+        return ts
+
+
+def new_node(item=None):
+    """
+    Create an empty tree node.  Subtrees are searched in the order: the
+    ``exact`` subtree for a key, then the ``wild`` subtree, then each
+    of the ``shadowed`` dictionaries in turn.  There is only ever more
+    than one shadowed dictionary if the same key was shadowed more
+    than once.
+
+    """
+    return {'item': item, 'exact': {}, 'wild': None, 'shadowed': []}
+
+
+def children(tree):
+    """
+    Generate ``(index, key, subtree)`` triples for the subtrees of a
+    node in search order.  Indexes are ``None`` for the wildcard
+    subtree, zero for exact subtrees and ``i + 1`` for the ``i``'th
+    shadowed dictionary.
+
+    """
+    for k, st in tree['exact'].items():
+        yield 0, k, st
+    if tree['wild'] is not None:
+        yield None, '*', tree['wild']
+    for i, tier in enumerate(tree['shadowed']):
+        for k, st in tier.items():
+            yield i + 1, k, st
+
+
+def exact_child(tree, head, shadowed):
+    """
+    Find the first subtree whose key is exactly ``head``, optionally
+    looking past the wildcard into shadowed subtrees.
+
+    """
+    if head == '*':
+        return tree['wild']
+    st = tree['exact'].get(head)
+    if st is None and shadowed:
+        for tier in tree['shadowed']:
+            st = tier.get(head)
+            if st is not None:
+                break
+    return st
+
+
+def child_by_idx(tree, idx):
+    """
+    Look up a subtree using an ``(index, key)`` pair as generated by
+    ``find_in_tree``.
+
+    """
+    tier, k = idx
+    if tier is None:
+        return tree['wild']
+    elif tier == 0:
+        return tree['exact'][k]
+    else:
+        return tree['shadowed'][tier - 1][k]
+
+
+def merge_tiers(tiers):
+    """
+    Merge a sequence of key/subtree dictionaries into as few
+    dictionaries as possible, keeping the relative order of subtrees
+    sharing the same key.
+
+    """
+    merged = []
+    depth = {}
+    for tier in tiers:
+        for k, st in tier.items():
+            d = depth.get(k, 0)
+            if d == len(merged):
+                merged.append({})
+            merged[d][k] = st
+            depth[k] = d + 1
+    return merged
+
+
+def from_list_node(tree):
+    """
+    Convert a node from the older JSON representation, where subtrees
+    are stored as an ordered list of ``(key, subtree)`` pairs.
+
+    """
+    node = new_node(tree['item'])
+    before, after = [], []
+    for k, st in tree['subtrees']:
+        if k == '*':
+            node['wild'] = from_list_node(st)
+        elif node['wild'] is None:
+            before.append({k: from_list_node(st)})
+        else:
+            after.append({k: from_list_node(st)})
+    tiers = merge_tiers(before)
+    node['exact'] = tiers[0] if tiers else {}
+    node['shadowed'] = tiers[1:] + merge_tiers(after)
+    return node
+
+
+def product_subtree(suffixes, value):
+    """
+    Build the subtree for a sequence of key path suffixes for sharing
+    between prefixes (see ``WildTree.set_product``).  The subtree is
+    built below a dummy prefix, mirroring insertion into a larger
+    tree.  Returns ``False`` if the dummy prefix was pruned along the
+    way: the pruning would then have reached above the prefix in the
+    larger tree, so the subtree can't be used there.
+
+    """
+    tmp = WildTree()
+    for suffix in suffixes:
+        node = tmp.root['exact'].get('')
+        tmp[('',) + suffix] = value
+        if node is not None and tmp.root['exact'][''] is not node:
+            return False
+    return tmp.root['exact']['']
+
+
+def copy_node(tree, shared):
+    """
+    Make a copy of a shared node for modification.  The node's subtrees
+    are then shared with the copy.
+
+    """
+    node = {'item': tree['item'], 'exact': dict(tree['exact']),
+            'wild': tree['wild'],
+            'shadowed': [dict(tier) for tier in tree['shadowed']]}
+    for _, _, st in children(node):
+        shared[id(st)] = st
+    return node
+
+
+def replace_child(tree, head, old, new):
+    """
+    Replace the subtree ``old`` for key component ``head`` with ``new``.
+    """
+    if head == '*':
+        tree['wild'] = new
+    elif tree['exact'].get(head) is old:
+        tree['exact'][head] = new
+    else:
+        for tier in tree['shadowed']:
+            if tier.get(head) is old:
+                tier[head] = new
+                break
+    return new
+
+
+def del_by_idx(tree, idxs, shared=None):
     """
-    Delete a key entry based on numerical indexes into subtree lists.
+    Delete a key entry based on an index path through the subtrees,
+    copying any shared nodes on the path.
+
     """
     if len(idxs) == 0:
         tree['item'] = None
-        tree['subtrees'] = []
+        tree['exact'] = {}
+        tree['wild'] = None
+        tree['shadowed'] = []
     else:
         hidx, tidxs = idxs[0], idxs[1:]
-        del_by_idx(tree['subtrees'][hidx][1], tidxs)
-        if len(tree['subtrees'][hidx][1]['subtrees']) == 0:
-            del tree['subtrees'][hidx]
+        st = child_by_idx(tree, hidx)
+        if shared and id(st) in shared:
+            st = replace_child(tree, hidx[1], st, copy_node(st, shared))
+        del_by_idx(st, tidxs, shared)
+        if not (st['exact'] or st['wild'] is not None or st['shadowed']):
+            tier, k = hidx
+            if tier is None:
+                # Exact subtrees are no longer shadowed once the
+                # wildcard subtree is removed.
+                tree['wild'] = None
+                tiers = merge_tiers([tree['exact']] + tree['shadowed'])
+                tree['exact'] = tiers[0] if tiers else {}
+                tree['shadowed'] = tiers[1:]
+            elif tier == 0:
+                del tree['exact'][k]
+            else:
+                del tree['shadowed'][tier - 1][k]
+                if not tree['shadowed'][tier - 1]:
+                    del tree['shadowed'][tier - 1]
 
 
 def find_in_tree(tree, key, perfect=False):
     """
-    Helper to perform find in dictionary tree.
+    Helper to perform find in dictionary tree.  Returns the value for
+    the key along with the index path through the subtrees to it.
+    Throws ``KeyError`` if the key path doesn't exist in the tree.
+
     """
-    if len(key) == 0:
-        if tree['item'] is not None:
-            return tree['item'], ()
-        else:
-            for i in range(len(tree['subtrees'])):
-                if not perfect and tree['subtrees'][i][0] == '*':
-                    item, trace = find_in_tree(tree['subtrees'][i][1],
-                                               (), perfect)
-                    return item, (i,) + trace
-            raise KeyError(key)
-    else:
-        head, tail = key[0], key[1:]
-        for i in range(len(tree['subtrees'])):
-            if tree['subtrees'][i][0] == head or \
-               not perfect and tree['subtrees'][i][0] == '*':
-                try:
-                    item, trace = find_in_tree(tree['subtrees'][i][1],
-                                               tail, perfect)
-                    return item, (i,) + trace
-                except KeyError:
-                    pass
+    found = search(tree, key, perfect, trace=True)
+    if found is None:
         raise KeyError(key)
+    return found
+
+
+def search(tree, key, perfect=False, trace=False):
+    """
+    Iterative depth-first search for a key path, trying subtrees in the
+    same order as the recursive definition of wildcard matching:
+    exact subtree, then wildcard subtree, then shadowed subtrees.  If
+    there is no key path left, a wildcard subtree can still match
+    (unless ``perfect`` is set).  Returns ``None`` if the key path
+    isn't found, otherwise the value for the key, or a pair of the
+    value and the index path to it if ``trace`` is set.
+
+    """
+    n = len(key)
+    stack = []
+    idxs = []
+    node, i, d, idx = tree, 0, 0, None
+    while True:
+        if trace and d > 0:
+            del idxs[d - 1:]
+            idxs.append(idx)
+        wild = node['wild']
+        if i == n:
+            item = node['item']
+            if item is not None:
+                return (item, tuple(idxs)) if trace else item
+            if wild is not None and not perfect:
+                node, d, idx = wild, d + 1, WILD_IDX
+                continue
+        elif key[i] == '*':
+            if wild is not None:
+                node, i, d, idx = wild, i + 1, d + 1, WILD_IDX
+                continue
+        else:
+            # Descend into the first matching subtree, pushing any
+            # alternatives onto the stack in reverse search order.
+            head = key[i]
+            shadowed = node['shadowed']
+            if shadowed:
+                for t in range(len(shadowed) - 1, -1, -1):
+                    st = shadowed[t].get(head)
+                    if st is not None:
+                        stack.append((st, i + 1, d + 1, (t + 1, head)))
+            st = node['exact'].get(head)
+            if wild is not None and not perfect:
+                if st is None:
+                    node, i, d, idx = wild, i + 1, d + 1, WILD_IDX
+                    continue
+                stack.append((wild, i + 1, d + 1, WILD_IDX))
+            if st is not None:
+                node, i, d, idx = st, i + 1, d + 1, (0, head)
+                continue
+        if not stack:
+            return None
+        node, i, d, idx = stack.pop()
+
+
+WILD_IDX = (None, '*')
+
+
+def alternatives(tree, key):
+    """
+    Helper for ``WildTree.alternatives``.  Subtrees are visited in the
+    same order as in ``search``.  The exact subtrees of a node below a
+    free component are mutually exclusive, so those with the same
+    alternatives are grouped into a single condition.  Alternatives
+    after one with no conditions are unreachable, and are dropped.
+
+    """
+    n = len(key)
+    memo = {}
+
+    def tier_alts(tier, i):
+        groups = {}
+        for k, st in tier.items():
+            groups.setdefault(alts(st, i + 1), []).append(k)
+        return [(((i, tuple(sorted(ks))),) + conds, item)
+                for sub, ks in groups.items() for conds, item in sub]
+
+    def alts(node, i):
+        memo_key = (id(node), i)
+        if memo_key in memo:
+            return memo[memo_key]
+        res = []
+        if i == n:
+            if node['item'] is not None:
+                res.append(((), node['item']))
+            elif node['wild'] is not None:
+                res.extend(alts(node['wild'], i))
+        elif key[i] is None:
+            res.extend(tier_alts(node['exact'], i))
+            if node['wild'] is not None:
+                res.extend(alts(node['wild'], i + 1))
+            for tier in node['shadowed']:
+                res.extend(tier_alts(tier, i))
+        else:
+            for _, st in candidates(node, key[i], perfect=False):
+                res.extend(alts(st, i + 1))
+        for j, (conds, _) in enumerate(res):
+            if not conds:
+                del res[j + 1:]
+                break
+        memo[memo_key] = tuple(res)
+        return memo[memo_key]
+
+    return alts(tree, 0)
+
+
+def candidates(tree, head, perfect):
+    """
+    Generate ``((index, key), subtree)`` pairs for the subtrees of a node
+    that match a key component, in search order.
+
+    """
+    if head != '*':
+        st = tree['exact'].get(head)
+        if st is not None:
+            yield (0, head), st
+    if tree['wild'] is not None and (head == '*' or not perfect):
+        yield (None, '*'), tree['wild']
+    if head != '*':
+        for i, tier in enumerate(tree['shadowed']):
+            st = tier.get(head)
+            if st is not None:
+                yield (i + 1, head), st
+
+
+def dominated_keys(tree, key):
+    """
+    Generate the key paths in a tree that are dominated by a given key
+    path, following only those subtrees whose keys could be dominated.
+
+    """
+    stack = [(tree, ())]
+    while stack:
+        node, prefix = stack.pop()
+        if len(prefix) == len(key):
+            if node['item'] is not None:
+                yield prefix
+        elif key[len(prefix)] == '*':
+            for _, k, st in children(node):
+                stack.append((st, prefix + (k,)))
+        else:
+            head = key[len(prefix)]
+            for _, st in candidates(node, head, perfect=True):
+                stack.append((st, prefix + (head,)))
 
 
 def dominates(p, q):